@@ -216,7 +216,8 @@ and its value must be on separate lines in the file.
 
     args = parser.parse_args()
 
-    init_treeherder(args.treeherder_url)
+    init_treeherder(args.treeherder_url, offline=args.offline,
+                    repositories_ttl=args.repositories_ttl)
 
     logging.basicConfig(level=getattr(logging, args.log_level))
     logger = logging.getLogger()
@@ -4,10 +4,15 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import argparse
+import collections
+import concurrent.futures
+import functools
+import itertools
 import json
 import logging
+import warnings
 
-from statistics import mean, stdev
+import numpy as np
 
 from scipy import stats
 
@@ -16,6 +21,10 @@ from common_args import ArgumentFormatter, log_level_args
 
 logger = None
 
+# The maximum number of resampled values held in memory at once when
+# computing the bootstrap confidence intervals.
+BOOTSTRAP_BATCH_SIZE = 4000000
+
 
 def load_json_data(filepath):
     with open(filepath) as f:
@@ -124,23 +133,15 @@ def extract_measurements(data):
     return measurements
 
 
-def generate_report(aliases, measurements):
-    line = "job_type_name,"
-
-    for alias in aliases:
-        line += ("{alias} measurement,"
-                 "{alias} mean,"
-                 "{alias} stdev,"
-                 "{alias} count,".format(alias=alias))
-    line += 'ttest_ind_from_stats statistic, ttest_ind_from_stats pvalue'
-
-    print(line)
-
+def get_report_rows(aliases, measurements):
+    """Return the list of (job_type_name, measurement_name) tuples to
+    report in sorted measurement_name order for each job_type_name."""
+    rows = []
     for job_type_name in measurements:
 
         if set(aliases) != set(measurements[job_type_name].keys()):
             # Only report on job_type_names which have measurements
-            # from both aliases.
+            # from all aliases.
             continue
 
         measurement_names = set()
@@ -148,63 +149,328 @@ def generate_report(aliases, measurements):
             measurement_names.update(set(measurements[job_type_name][alias].keys()))
 
         for measurement_name in sorted(measurement_names):
+            rows.append((job_type_name, measurement_name))
+    return rows
+
+
+def collect_values(alias, rows, measurements):
+    """Return a tuple (values, row_indexes) of numpy arrays containing
+    the values of each row's measurement for alias in row order and
+    the index of the row of each value. Missing measurements and None
+    values are skipped."""
+    row_indexes = []
+    values = []
+    for (irow, (job_type_name, measurement_name)) in enumerate(rows):
+        measurement = measurements[job_type_name][alias].get(measurement_name, None)
+        if measurement is None:
+            continue
+        row_values = [value for value in measurement['values'] if value is not None]
+        values.extend(row_values)
+        row_indexes.extend(itertools.repeat(irow, len(row_values)))
+    return (np.array(values, dtype=float), np.array(row_indexes, dtype=np.intp))
+
+
+def compute_statistics(values, row_indexes, nrows):
+    """Return a dict of numpy arrays count, mean and stdev containing the
+    statistics of the values of each of the nrows rows.
+
+    The statistics are computed for all rows together. The mean of a
+    row without values is nan and the stdev of a row with fewer than
+    two values is 0.
+    """
+    counts = np.bincount(row_indexes, minlength=nrows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.bincount(row_indexes, weights=values, minlength=nrows) / counts
+        deviations = values - means[row_indexes]
+        variances = np.bincount(row_indexes, weights=deviations * deviations,
+                                minlength=nrows) / (counts - 1)
+        stdevs = np.where(counts > 1, np.sqrt(variances), 0.0)
+    return {
+        'count': counts,
+        'mean': means,
+        'stdev': stdevs,
+    }
+
+
+def compute_ttests(left, right):
+    """Return a tuple (statistics, pvalues) of numpy arrays containing
+    Welch's t-test for each row of the statistics left and right.
+    Rows without values are treated as having mean 0, stdev 0 and count
+    0 which results in nan."""
+    left_means = np.where(left['count'] > 0, left['mean'], 0.0)
+    right_means = np.where(right['count'] > 0, right['mean'], 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        ttest = stats.ttest_ind_from_stats(left_means, left['stdev'], left['count'],
+                                           right_means, right['stdev'], right['count'],
+                                           equal_var=False)
+    return (np.atleast_1d(ttest.statistic), np.atleast_1d(ttest.pvalue))
+
+
+def compute_mannwhitneyu(left_values, right_values):
+    """Return a tuple (statistics, pvalues) of numpy arrays containing
+    the two-sided Mann-Whitney U test for each row where left_values
+    and right_values are lists of the arrays of values of each row.
+
+    Rows with the same numbers of values are tested together. Rows
+    with ties are tested separately from rows without ties since the
+    method used to compute the pvalue depends on the presence of ties.
+    Rows where either alias has no values are nan.
+    """
+    nrows = len(left_values)
+    statistics = np.full(nrows, np.nan)
+    pvalues = np.full(nrows, np.nan)
+
+    groups = collections.defaultdict(list)
+    for (irow, (left, right)) in enumerate(zip(left_values, right_values)):
+        if len(left) == 0 or len(right) == 0:
+            continue
+        has_ties = len(np.unique(np.concatenate((left, right)))) < len(left) + len(right)
+        groups[(len(left), len(right), has_ties)].append(irow)
+
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for irows in groups.values():
+            result = stats.mannwhitneyu(np.array([left_values[irow] for irow in irows]),
+                                        np.array([right_values[irow] for irow in irows]),
+                                        alternative='two-sided', axis=1)
+            statistics[irows] = result.statistic
+            pvalues[irows] = result.pvalue
+    return (statistics, pvalues)
+
+
+def compute_bootstrap_cis(rows, left_values, right_values, first_row, samples, confidence, seed):
+    """Return a tuple (lows, highs) of numpy arrays containing the
+    percentile bootstrap confidence interval of the difference of the
+    right and left means for each of rows where left_values and
+    right_values are lists of the arrays of values of each row.
+
+    Rows of the same job type with the same numbers of values are
+    resampled together in batches of at most BOOTSTRAP_BATCH_SIZE
+    values. Each batch uses a random generator seeded by seed and the
+    index in the report of its first row, first_row + irow, so the
+    intervals do not depend on how the job types are divided among
+    processes. Rows where either alias has no values are nan.
+    """
+    nrows = len(left_values)
+    lows = np.full(nrows, np.nan)
+    highs = np.full(nrows, np.nan)
+    alpha = (1.0 - confidence) / 2.0
+
+    groups = collections.defaultdict(list)
+    for (irow, (left, right)) in enumerate(zip(left_values, right_values)):
+        if len(left) == 0 or len(right) == 0:
+            continue
+        groups[(rows[irow][0], len(left), len(right))].append(irow)
+
+    for ((job_type_name, nleft, nright), group_irows) in groups.items():
+        batch_size = max(1, BOOTSTRAP_BATCH_SIZE // (samples * max(nleft, nright)))
+        for ibatch in range(0, len(group_irows), batch_size):
+            irows = group_irows[ibatch:ibatch + batch_size]
+            rng = np.random.default_rng([seed, first_row + irows[0]])
+            batch = np.arange(len(irows))[:, None, None]
+            left = np.array([left_values[irow] for irow in irows])
+            right = np.array([right_values[irow] for irow in irows])
+            left_means = left[batch, rng.integers(0, nleft, (len(irows), samples, nleft))].mean(axis=2)
+            right_means = right[batch, rng.integers(0, nright, (len(irows), samples, nright))].mean(axis=2)
+            (lows[irows], highs[irows]) = np.quantile(right_means - left_means,
+                                                      [alpha, 1.0 - alpha], axis=1)
+    return (lows, highs)
+
+
+def benjamini_hochberg(pvalues):
+    """Return a numpy array of the Benjamini-Hochberg false discovery
+    rate adjusted pvalues (qvalues) of the numpy array pvalues. nan
+    pvalues are not counted as tests and have nan qvalues."""
+    qvalues = np.full(len(pvalues), np.nan)
+    tested = np.flatnonzero(~np.isnan(pvalues))
+    ntests = len(tested)
+    if ntests == 0:
+        return qvalues
+    order = tested[np.argsort(pvalues[tested], kind='stable')]
+    adjusted = pvalues[order] * ntests / np.arange(1, ntests + 1)
+    adjusted = np.minimum.accumulate(adjusted[::-1])[::-1]
+    qvalues[order] = np.minimum(adjusted, 1.0)
+    return qvalues
+
+
+def get_alias_pairs(aliases):
+    """Return the list of pairs of aliases to be compared."""
+    return list(itertools.combinations(aliases, 2))
+
+
+def get_pair_column_names(args):
+    """Return the list of the names of the columns reported for each
+    pair of aliases."""
+    column_names = ['ttest_ind_from_stats statistic', 'ttest_ind_from_stats pvalue']
+    if args.fdr:
+        column_names.append('ttest_ind_from_stats qvalue')
+    if args.mannwhitneyu:
+        column_names.extend(['mannwhitneyu statistic', 'mannwhitneyu pvalue'])
+        if args.fdr:
+            column_names.append('mannwhitneyu qvalue')
+    if args.bootstrap:
+        confidence = '%g%%' % (100 * args.confidence)
+        column_names.extend(['bootstrap %s ci low' % confidence,
+                             'bootstrap %s ci high' % confidence])
+    return column_names
+
+
+def compare_rows(args, aliases, first_row, rows, measurements):
+    """Return a tuple (alias_columns, pair_columns) for rows where
+    alias_columns maps each alias to a dict of the numpy arrays count,
+    mean and stdev and pair_columns is a list containing a dict of the
+    numpy arrays for each column computed for each pair of aliases.
+    first_row is the index of rows[0] in the report. The qvalues which
+    depend on all of the rows are not computed."""
+    nrows = len(rows)
+
+    alias_columns = {}
+    alias_values = {}
+    for alias in aliases:
+        (values, row_indexes) = collect_values(alias, rows, measurements)
+        alias_columns[alias] = compute_statistics(values, row_indexes, nrows)
+        if args.mannwhitneyu or args.bootstrap:
+            alias_values[alias] = np.split(values, np.cumsum(alias_columns[alias]['count'])[:-1])
+
+    pair_columns = []
+    for (alias0, alias1) in get_alias_pairs(aliases):
+        columns = {}
+        (columns['ttest_ind_from_stats statistic'],
+         columns['ttest_ind_from_stats pvalue']) = compute_ttests(alias_columns[alias0],
+                                                                  alias_columns[alias1])
+        if args.mannwhitneyu:
+            (columns['mannwhitneyu statistic'],
+             columns['mannwhitneyu pvalue']) = compute_mannwhitneyu(alias_values[alias0],
+                                                                    alias_values[alias1])
+        if args.bootstrap:
+            confidence = '%g%%' % (100 * args.confidence)
+            (columns['bootstrap %s ci low' % confidence],
+             columns['bootstrap %s ci high' % confidence]) = compute_bootstrap_cis(
+                 rows, alias_values[alias0], alias_values[alias1], first_row,
+                 args.bootstrap, args.confidence, args.seed)
+        pair_columns.append(columns)
+
+    return (alias_columns, pair_columns)
+
+
+def compare_chunk(args, aliases, chunk):
+    """Return compare_rows for the chunk (first_row, rows, measurements)."""
+    (first_row, rows, measurements) = chunk
+    return compare_rows(args, aliases, first_row, rows, measurements)
+
+
+def get_row_chunks(rows, measurements, nchunks):
+    """Return a list of up to nchunks tuples (first_row, rows,
+    measurements) dividing rows into consecutive chunks of similar size
+    which do not split a job type. Each chunk contains only the
+    measurements of its job types."""
+    chunk_size = max(1, -(-len(rows) // nchunks))
+    chunks = []
+    first_row = 0
+    while first_row < len(rows):
+        last_row = min(first_row + chunk_size, len(rows))
+        while last_row < len(rows) and rows[last_row][0] == rows[last_row - 1][0]:
+            last_row += 1
+        chunk_rows = rows[first_row:last_row]
+        chunk_measurements = {}
+        for (job_type_name, measurement_name) in chunk_rows:
+            chunk_measurements[job_type_name] = measurements[job_type_name]
+        chunks.append((first_row, chunk_rows, chunk_measurements))
+        first_row = last_row
+    return chunks
+
+
+def generate_report(args, aliases, measurements):
+    alias_pairs = get_alias_pairs(aliases)
+    column_names = get_pair_column_names(args)
 
-            line = job_type_name + ','
-
-            # save the values lists for each alias for use in calculating the t-test
-            alias_values = {}
-            alias_means = {}
-            alias_counts = {}
-            alias_stdevs = {}
-
-            for alias in aliases:
-                if measurement_name not in measurements[job_type_name][alias]:
-                    alias_values[alias] = []
-                    alias_means[alias] = 0
-                    alias_counts[alias] = 0
-                    alias_stdevs[alias] = 0
-                    count_values = None
-                    mean_values = None
-                    stdev_values = None
-                else:
-                    alias_values[alias] = measurements[job_type_name][alias][measurement_name]['values']
-
-                    count_values = len(measurements[job_type_name][alias][measurement_name]['values'])
-                    if count_values == 0:
-                        continue
+    line = "job_type_name,"
 
-                    if count_values == 1:
-                        mean_values = measurements[job_type_name][alias][measurement_name]['values'][0]
-                        stdev_values = 0
-                    else:
-                        mean_values = mean(measurements[job_type_name][alias][measurement_name]['values'])
-                        stdev_values = stdev(measurements[job_type_name][alias][measurement_name]['values'])
+    for alias in aliases:
+        line += ("{alias} measurement,"
+                 "{alias} mean,"
+                 "{alias} stdev,"
+                 "{alias} count,".format(alias=alias))
+    if len(alias_pairs) == 1:
+        line += ', '.join(column_names)
+    else:
+        line += ', '.join(
+            '{alias0} vs {alias1} {column_name}'.format(alias0=alias0, alias1=alias1,
+                                                        column_name=column_name)
+            for (alias0, alias1) in alias_pairs for column_name in column_names)
+
+    print(line)
+
+    rows = get_report_rows(aliases, measurements)
+    if not rows:
+        return
+
+    # Compare the job types in parallel in chunks of rows and join the
+    # results.
+    compare = functools.partial(compare_chunk, args, aliases)
+    if args.processes > 1:
+        chunks = get_row_chunks(rows, measurements, 4 * args.processes)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.processes) as executor:
+            results = list(executor.map(compare, chunks))
+    else:
+        results = [compare((0, rows, measurements))]
+
+    alias_statistics = {}
+    for alias in aliases:
+        alias_statistics[alias] = {}
+        for name in ('mean', 'stdev', 'count'):
+            alias_statistics[alias][name] = np.concatenate(
+                [alias_columns[alias][name] for (alias_columns, pair_columns) in results])
+
+    pair_statistics = []
+    for ipair in range(len(alias_pairs)):
+        columns = {}
+        for name in results[0][1][ipair]:
+            columns[name] = np.concatenate(
+                [pair_columns[ipair][name] for (alias_columns, pair_columns) in results])
+        if args.fdr:
+            # Correct for the number of measurements compared.
+            columns['ttest_ind_from_stats qvalue'] = benjamini_hochberg(
+                columns['ttest_ind_from_stats pvalue'])
+            if args.mannwhitneyu:
+                columns['mannwhitneyu qvalue'] = benjamini_hochberg(
+                    columns['mannwhitneyu pvalue'])
+        pair_statistics.append(columns)
+
+    # Convert the arrays to lists of python values for formatting.
+    alias_columns = {}
+    for alias in aliases:
+        alias_columns[alias] = (
+            alias_statistics[alias]['mean'].tolist(),
+            alias_statistics[alias]['stdev'].tolist(),
+            alias_statistics[alias]['count'].tolist(),
+        )
+
+    report_columns = []
+    for columns in pair_statistics:
+        for column_name in column_names:
+            report_columns.append(columns[column_name].tolist())
+
+    for (irow, (job_type_name, measurement_name)) in enumerate(rows):
 
-                    alias_means[alias] = mean_values
-                    alias_counts[alias] = count_values
-                    alias_stdevs[alias] = stdev_values
+        line = job_type_name + ','
 
-                # Remove any commas embedded in the measurement name
-                # to prevent them from interfering with the csv format.
-                measurement_name = measurement_name.replace(',', ' ')
+        # Remove any commas embedded in the measurement name
+        # to prevent them from interfering with the csv format.
+        measurement_name = measurement_name.replace(',', ' ')
+
+        for alias in aliases:
+            (means, stdevs, counts) = alias_columns[alias]
+            if counts[irow] == 0:
+                line += "%s,None,None,None," % measurement_name
+            else:
                 line += "%s,%s,%s,%s," % (measurement_name,
-                                          mean_values,
-                                          stdev_values,
-                                          count_values)
-            #ttest = stats.ttest_ind(alias_values[aliases[0]], alias_values[aliases[1]])
-            alias0 = aliases[0]
-            alias1 = aliases[1]
-            try:
-                ttest = stats.ttest_ind_from_stats(alias_means[alias0], alias_stdevs[alias0], alias_counts[alias0],
-                                                   alias_means[alias1], alias_stdevs[alias1], alias_counts[alias1],
-                                                   equal_var=False)
-                statistic = ttest.statistic
-                pvalue = ttest.pvalue
-            except ZeroDivisionError:
-                statistic = None
-                pvalue = None
-            line += "%s, %s" % (statistic, pvalue)
-            print(line)
+                                          means[irow],
+                                          stdevs[irow],
+                                          counts[irow])
+        line += ', '.join("%s" % report_column[irow] for report_column in report_columns)
+        print(line)
 
 
 def main():
@@ -220,6 +486,11 @@ summary report in csv format comparing the different summaries in the
 combination.
 
 The summary report contains the average and standard deviations of the PERFHERDER_DATA.
+
+Each pair of aliases is compared using Welch's t-test and optionally
+the Mann-Whitney U test and a bootstrap confidence interval for the
+difference of the means. The false discovery rate over all of the
+measurements can be controlled using the Benjamini-Hochberg qvalues.
 """,
         formatter_class=ArgumentFormatter,
         epilog="""You can save a set of arguments to a file and specify them later
@@ -236,6 +507,39 @@ and its value must be on separate lines in the file.""",
                         required=True,
                         help='Path to summarized log file to analyze.')
 
+    parser.add_argument('--mannwhitneyu',
+                        action='store_true',
+                        default=False,
+                        help='Report the Mann-Whitney U test for each measurement.')
+
+    parser.add_argument('--bootstrap',
+                        type=int,
+                        default=0,
+                        help='Number of bootstrap resamples used to report a confidence interval '
+                        'for the difference of the means of each measurement. 0 disables the '
+                        'confidence intervals.')
+
+    parser.add_argument('--confidence',
+                        type=float,
+                        default=0.95,
+                        help='Confidence level of the bootstrap confidence intervals.')
+
+    parser.add_argument('--seed',
+                        type=int,
+                        default=1,
+                        help='Random seed used for the bootstrap resamples.')
+
+    parser.add_argument('--fdr',
+                        action='store_true',
+                        default=False,
+                        help='Report the Benjamini-Hochberg false discovery rate adjusted '
+                        'pvalues (qvalues) of the tests over all measurements.')
+
+    parser.add_argument('--processes',
+                        type=int,
+                        default=1,
+                        help='Number of worker processes used to compare the job types.')
+
     args = parser.parse_args()
 
     logging.basicConfig(level=getattr(logging, args.log_level))
@@ -244,7 +548,8 @@ and its value must be on separate lines in the file.""",
     data = load_json_data(args.file)
     measurements = extract_measurements(data)
     aliases = extract_aliases(data)
-    generate_report(aliases, measurements)
+    generate_report(args, aliases, measurements)
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Benchmark the normalization of test lines by combine_log_summaries.py.
+"""
+
+import argparse
+import copy
+import json
+import logging
+import random
+import sys
+import time
+
+from common_args import ArgumentFormatter, log_level_args
+
+from combine_log_summaries import munge_test_data, munge_test_line
+
+logger = logging.getLogger()
+
+TEST_LINE_FORMATS = [
+    'TEST-PASS | dom/tests/mochitest/test_%(n)d.html | check %(n)d took %(ms)dms',
+    'TEST-PASS | file:///builds/worker/workspace/build/tests/reftest/tests/layout/%(n)d.html == '
+    'file:///builds/worker/workspace/build/tests/reftest/tests/layout/%(n)d-ref.html | image comparison, '
+    'max difference: 0, number of differing pixels: 0',
+    'TEST-UNEXPECTED-FAIL | http://localhost:%(port)d/%(n)d/%(ms)d/tests/test_%(n)d.html | '
+    'Date(%(date)d) should not be set',
+    'TEST-INFO | started process %(pid)d | %(pid)d: exit 0',
+    'TEST-PASS | dom/media/test/test_%(n)d.html | [finished test_%(n)d.html t=%(ms)d.123]',
+    'TEST-PASS | toolkit/components/places/tests/test_%(n)d.js | should have a guid - "abcdef%(n)06d"',
+    'TEST-PASS | js/src/tests/test_%(n)d.js | task_%(date)d [%(ms)d.5 s]',
+    'TEST-INFO | started process GECKO(%(pid)d)',
+]
+
+
+def generate_test_data(args):
+    """Return a list of test_data dicts containing synthetic test lines."""
+    rng = random.Random(args.seed)
+    test_datas = []
+    for ijob in range(args.jobs):
+        test_lines = []
+        for iline in range(args.lines):
+            test_line_format = rng.choice(TEST_LINE_FORMATS)
+            test_lines.append(test_line_format % {
+                'n': rng.randrange(args.tests),
+                'ms': rng.randrange(1000),
+                'port': rng.randrange(1024, 65536),
+                'date': rng.randrange(1500000000, 1600000000),
+                'pid': rng.randrange(100000),
+            })
+        test_datas.append({'TEST-PASS': {'counts': len(test_lines), 'list': test_lines}})
+    return test_datas
+
+
+def load_test_data(files):
+    """Return a list of the test_data dicts in the log summary files."""
+    test_datas = []
+    for input_file_path in files:
+        with open(input_file_path) as input_file:
+            input_json = json.load(input_file)
+        for data in input_json.values():
+            for sub_data in data.values():
+                if 'test_data' in sub_data:
+                    test_datas.append(sub_data['test_data'])
+    return test_datas
+
+
+def benchmark(args, test_datas, clear_cache):
+    """Return the results of munging copies of test_datas using the
+    best time of args.repeat runs."""
+    nlines = sum(len(test_data[test_status].get('list', []))
+                 for test_data in test_datas for test_status in test_data)
+    seconds = None
+    for irepeat in range(args.repeat):
+        copies = copy.deepcopy(test_datas)
+        if clear_cache:
+            munge_test_line.cache_clear()
+        start = time.perf_counter()
+        for test_data in copies:
+            munge_test_data(test_data)
+        elapsed = time.perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    return {
+        'lines': nlines,
+        'seconds': seconds,
+        'lines_per_second': nlines / seconds if seconds > 0 else None,
+    }
+
+
+def main():
+    """main"""
+
+    parent_parsers = [log_level_args.get_parser()]
+
+    additional_descriptions = [parser.description for parser in parent_parsers
+                               if parser.description]
+    additional_epilogs = [parser.epilog for parser in parent_parsers if parser.epilog]
+
+    parser = argparse.ArgumentParser(
+        description="""
+Benchmark the number of test lines normalized per second by
+combine_log_summaries.munge_test_data, writing results as json to
+stdout.
+
+The cold results clear the cache of munged lines before each run while
+the warm results reuse it as when the same lines occur in the summaries
+for several aliases.
+
+The test lines are synthetic lines generated from --seed unless log
+summary files are specified with --file.
+
+%s
+
+""" % '\n\n'.join(additional_descriptions),
+        formatter_class=ArgumentFormatter,
+        epilog="""
+%s
+
+You can save a set of arguments to a file and specify them later using
+the @argfile syntax. The arguments contained in the file will replace
+@argfile in the command line. Multiple files can be loaded into the
+command line through the use of the @ syntax.
+
+Each argument and its value must be on separate lines in the file.
+
+""" % '\n\n'.join(additional_epilogs),
+        parents=parent_parsers,
+        fromfile_prefix_chars='@'
+    )
+
+    parser.add_argument(
+        '--file',
+        dest='files',
+        action='append',
+        default=[],
+        help='Log summary json file to use instead of synthetic test lines. '
+        'May be specified multiple times.')
+
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=20,
+        help='Number of synthetic test_data objects.')
+
+    parser.add_argument(
+        '--lines',
+        type=int,
+        default=10000,
+        help='Number of synthetic test lines in each test_data object.')
+
+    parser.add_argument(
+        '--tests',
+        type=int,
+        default=5000,
+        help='Number of distinct test numbers used in synthetic test lines.')
+
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=1,
+        help='Random seed used to generate the synthetic test lines.')
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Number of runs. The best time is reported.')
+
+    parser.add_argument(
+        '--raw',
+        action='store_true',
+        default=False,
+        help='Do not reformat/indent json.')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level))
+    logger.debug("main %s", args)
+
+    if args.files:
+        test_datas = load_test_data(args.files)
+    else:
+        test_datas = generate_test_data(args)
+
+    results = {
+        'cold': benchmark(args, test_datas, True),
+        'warm': benchmark(args, test_datas, False),
+    }
+
+    if args.raw:
+        json.dump(results, sys.stdout)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
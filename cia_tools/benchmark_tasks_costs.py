@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Benchmark the cost lookups used by tasks_costs.py.
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import sys
+import time
+
+from common_args import ArgumentFormatter, log_level_args
+
+from tasks_costs import WILDCARD, CostIndex, args_key
+
+logger = logging.getLogger()
+
+PROJECTS = ('autoland', 'mozilla-central', 'try')
+COLLECTIONS = ('opt', 'debug', 'asan', 'pgo')
+
+
+def generate_costs_tasks(args):
+    """Return a tuple (cost_dict, lookups) where cost_dict maps cost
+    keys to synthetic costs as in tasks_costs.py and lookups is a list
+    of (provisionerId, workerType, project, tier, suite, groupSymbol,
+    symbol, collection) task lookups, some of which do not specify a
+    suite or groupSymbol or do not have a cost."""
+    rng = random.Random(args.seed)
+
+    cost_dict = {}
+    lookups = []
+    for icost in range(args.costs):
+        cost = {
+            'provisionerId': 'gecko-t',
+            'workerType': 't-linux-%d' % rng.randrange(20),
+            'project': rng.choice(PROJECTS),
+            'tier': rng.randrange(1, 4),
+            'suite': 'suite-%d' % rng.randrange(200),
+            'groupSymbol': 'G%d' % rng.randrange(100),
+            'symbol': 'S%d' % icost,
+            'collection': rng.choice(COLLECTIONS),
+            'cost': rng.random() * 1000,
+        }
+        cost_key = args_key(
+            cost['provisionerId'],
+            cost['workerType'],
+            cost['project'],
+            cost['tier'],
+            cost['suite'],
+            cost['groupSymbol'],
+            cost['symbol'],
+            cost['collection'],
+        )
+        cost_dict[cost_key] = cost
+
+    costs = list(cost_dict.values())
+    for itask in range(args.tasks):
+        cost = rng.choice(costs)
+        suite = cost['suite']
+        groupSymbol = cost['groupSymbol']
+        symbol = cost['symbol']
+        kind = rng.random()
+        if kind < 0.4:
+            suite = WILDCARD
+        elif kind < 0.6:
+            groupSymbol = WILDCARD
+        elif kind < 0.8:
+            symbol = 'N%d' % itask
+        lookups.append((
+            cost['provisionerId'],
+            cost['workerType'],
+            cost['project'],
+            cost['tier'],
+            suite,
+            groupSymbol,
+            symbol,
+            cost['collection'],
+        ))
+    return (cost_dict, lookups)
+
+
+def find_cost_keys_by_regex(cost_dict, *task_args):
+    """Return the list of cost keys matching the task using the
+    previous approach of matching the task key as a regular
+    expression against every cost key."""
+    task_key = args_key(*task_args)
+    if task_key in cost_dict:
+        return [task_key]
+    re_key = re.compile(task_key)
+    return list(set([key for key in cost_dict.keys() if re_key.match(key)]))
+
+
+def benchmark_lookups(args, func, lookups):
+    """Return a tuple (results, seconds) for the best of args.repeat
+    runs of func over lookups."""
+    seconds = None
+    for irepeat in range(args.repeat):
+        start = time.perf_counter()
+        results = [func(*lookup) for lookup in lookups]
+        elapsed = time.perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    return (results, seconds)
+
+
+def main():
+    """main"""
+
+    parent_parsers = [log_level_args.get_parser()]
+
+    additional_descriptions = [parser.description for parser in parent_parsers
+                               if parser.description]
+    additional_epilogs = [parser.epilog for parser in parent_parsers if parser.epilog]
+
+    parser = argparse.ArgumentParser(
+        description="""
+Benchmark the tasks_costs.py CostIndex lookups against matching each
+task key as a regular expression against every cost key, writing
+results as json to stdout.
+
+The benchmark uses synthetic costs and tasks generated from --seed.
+The results include the number of lookups where the two approaches
+found different costs.
+
+%s
+
+""" % '\n\n'.join(additional_descriptions),
+        formatter_class=ArgumentFormatter,
+        epilog="""
+%s
+
+You can save a set of arguments to a file and specify them later using
+the @argfile syntax. The arguments contained in the file will replace
+@argfile in the command line. Multiple files can be loaded into the
+command line through the use of the @ syntax.
+
+Each argument and its value must be on separate lines in the file.
+
+""" % '\n\n'.join(additional_epilogs),
+        parents=parent_parsers,
+        fromfile_prefix_chars='@'
+    )
+
+    parser.add_argument(
+        '--costs',
+        type=int,
+        default=5000,
+        help='Number of synthetic costs.')
+
+    parser.add_argument(
+        '--tasks',
+        type=int,
+        default=2000,
+        help='Number of synthetic task lookups.')
+
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=1,
+        help='Random seed used to generate the costs and tasks.')
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Number of times each lookup is run. The best time is reported.')
+
+    parser.add_argument(
+        '--raw',
+        action='store_true',
+        default=False,
+        help='Do not reformat/indent json.')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level))
+    logger.debug("main %s", args)
+
+    (cost_dict, lookups) = generate_costs_tasks(args)
+
+    start = time.perf_counter()
+    cost_index = CostIndex(cost_dict)
+    index_seconds = time.perf_counter() - start
+
+    (regex_results, regex_seconds) = benchmark_lookups(
+        args, lambda *task_args: find_cost_keys_by_regex(cost_dict, *task_args), lookups)
+    (index_results, lookup_seconds) = benchmark_lookups(args, cost_index.find, lookups)
+
+    mismatches = sum(1 for (regex_result, index_result) in zip(regex_results, index_results)
+                     if sorted(regex_result) != sorted(index_result))
+
+    results = {
+        'costs': len(cost_dict),
+        'lookups': len(lookups),
+        'regex_seconds': regex_seconds,
+        'index_build_seconds': index_seconds,
+        'index_seconds': lookup_seconds,
+        'speedup': regex_seconds / lookup_seconds if lookup_seconds > 0 else None,
+        'mismatches': mismatches,
+    }
+
+    if args.raw:
+        json.dump(results, sys.stdout)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Benchmark the stages of the test isolation matching pipeline.
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+
+from common_args import ArgumentFormatter, log_level_args
+
+from bugzilla_matching import BugSummaryMatcher, match_bug_summary_to_mozharness_failure
+
+from summarize_isolation_pushes_jobs_json import (
+    ISOLATION_SECTIONS,
+    ORIGINAL_SECTIONS,
+    convert_failure_to_pattern,
+    get_test,
+    summarize_test_isolation_data,
+)
+
+logger = logging.getLogger()
+
+REPOSITORY_URL = 'https://hg.mozilla.org/integration/autoland'
+
+FAILURE_MESSAGES = [
+    'Test timed out.',
+    'uncaught exception - TypeError: foo is undefined at chrome://mochitests/content/browser/head.js:12',
+    'leaked 1 window(s) until shutdown [url = about:blank]',
+    'Assertion count 3 is greater than expected range 0-0 assertions.',
+    'application crashed [@ mozilla::dom::Element::Focus]',
+    'got 0.00123, expected 0.5 - 1.25 at 12:34:56',
+]
+
+STAGES = ('match_bug_summary', 'match_bug_summary_batch', 'convert_failure_to_pattern',
+          'get_test', 'get_test_cached', 'summarize')
+
+
+def get_test_path(itest):
+    return 'dom/tests/mochitest/general/test_%04d.html' % itest
+
+
+def get_failure(itest):
+    """Return a synthetic failure line in one of the formats seen in
+    bugzilla suggestions. The test names and messages do not refer to
+    actual tests or bugs."""
+    message = FAILURE_MESSAGES[itest % len(FAILURE_MESSAGES)]
+    kind = itest % 4
+    if kind == 0:
+        return 'TEST-UNEXPECTED-FAIL | %s | %s' % (get_test_path(itest), message)
+    if kind == 1:
+        return ('REFTEST TEST-UNEXPECTED-FAIL | '
+                'file:///Z:/task_%d/build/tests/reftest/tests/layout/reftests/%d.html == '
+                'file:///Z:/task_%d/build/tests/reftest/tests/layout/reftests/%d-ref.html | '
+                'image comparison, max difference: 2, number of differing pixels: 4' % (
+                    itest, itest, itest, itest))
+    if kind == 2:
+        return 'GECKO(1234) | TEST-UNEXPECTED-TIMEOUT | %s | %s' % (get_test_path(itest), message)
+    return 'PROCESS-CRASH | %s | application crashed [@ mozilla::dom::Foo%d]' % (
+        get_test_path(itest), itest)
+
+
+def get_initial_comment(rng, failure, nlines):
+    """Return a synthetic initial bug comment containing the failure
+    among nlines of mozharness log output."""
+    lines = ['Filed by: nobody [at] example.com',
+             'Parsed log: https://example.com/logviewer?job_id=1',
+             '']
+    ifailure = rng.randrange(nlines)
+    for iline in range(nlines):
+        if iline == ifailure:
+            message = failure
+        else:
+            message = 'TEST-PASS | %s | check %d' % (get_test_path(rng.randrange(10000)), iline)
+        lines.append('[task 2019-07-11T23:31:%02d.213Z] 23:31:%02d     INFO -  %s' % (
+            iline % 60, iline % 60, message))
+    return '\n'.join(lines)
+
+
+def generate_corpus(args):
+    """Generate a synthetic corpus of bugs and test isolation jobs.
+
+    corpus = {
+        'bugs': [{'bug_summary': ..., 'initial_comment': ..., 'failure': ...}, ...],
+        'data': data as returned by convert_pushes_to_test_isolation_bugzilla_data,
+        'bugzilla_data': test isolation bugzilla data keyed by revision url,
+    }
+
+    """
+    rng = random.Random(args.seed)
+
+    corpus = {
+        'bugs': [],
+        'data': {},
+        'bugzilla_data': {},
+    }
+
+    job_id = 0
+    for irevision in range(args.revisions):
+        revision_url = '%s/rev/%040x' % (REPOSITORY_URL, rng.getrandbits(160))
+        revision_data = corpus['data'][revision_url] = {}
+        revision_bugzilla_data = corpus['bugzilla_data'][revision_url] = []
+
+        for ijob_type in range(args.job_types):
+            job_type_name = 'test-linux1804-64/opt-mochitest-%d' % ijob_type
+            itest = rng.randrange(args.tests)
+            failure = get_failure(itest)
+            bug_id = 1000000 + len(corpus['bugs'])
+
+            corpus['bugs'].append({
+                'bug_summary': 'Intermittent ' + failure,
+                'initial_comment': get_initial_comment(rng, failure, args.comment_lines),
+                'failure': failure,
+            })
+            revision_bugzilla_data.append({
+                'bug_id': bug_id,
+                'bug_summary': 'Intermittent ' + failure,
+                'job_type_name': job_type_name,
+                'mozharness_failure': failure,
+                'test': get_test(failure),
+                'pattern': convert_failure_to_pattern(failure),
+                'bugzilla_suggestions': [],
+                'failure_count': 1,
+            })
+
+            job_type = revision_data[job_type_name] = {}
+            for section_name in ORIGINAL_SECTIONS + ISOLATION_SECTIONS:
+                jobs = job_type[section_name] = []
+                njobs = 1 if section_name in ORIGINAL_SECTIONS else args.jobs
+                for ijob in range(njobs):
+                    job_id += 1
+                    suggestions = []
+                    for isuggestion in range(rng.randrange(args.suggestions + 1)):
+                        if rng.random() < 0.3:
+                            search = failure
+                        else:
+                            search = get_failure(rng.randrange(args.tests))
+                        suggestions.append({'search': search})
+                    jobs.append({
+                        'id': job_id,
+                        'result': 'testfailed' if suggestions else 'success',
+                        'start_timestamp': 0,
+                        'end_timestamp': rng.randrange(1, 3600),
+                        'bugzilla_suggestions': suggestions,
+                        'bug_job_map': [{'job_id': job_id, 'bug_id': bug_id}],
+                    })
+    return corpus
+
+
+def get_summarize_args(args):
+    return argparse.Namespace(
+        bugs=None,
+        override_bug_summary=None,
+        treeherder_url='https://treeherder.mozilla.org')
+
+
+def get_failures(corpus):
+    """Return the list of bugzilla suggestion failures in the corpus."""
+    failures = []
+    for revision_data in corpus['data'].values():
+        for job_type in revision_data.values():
+            for jobs in job_type.values():
+                for job in jobs:
+                    for suggestion in job['bugzilla_suggestions']:
+                        failures.append(suggestion['search'])
+    return failures
+
+
+def run_stage(args, corpus, stage):
+    """Return a tuple (items, func) where func performs the stage on
+    items inputs from corpus."""
+    if stage == 'match_bug_summary':
+        bugs = corpus['bugs']
+
+        def func():
+            for bug in bugs:
+                match_bug_summary_to_mozharness_failure(bug['bug_summary'],
+                                                        bug['initial_comment'])
+        return (len(bugs), func)
+
+    if stage == 'match_bug_summary_batch':
+        bugs = [(bug['bug_summary'], bug['initial_comment']) for bug in corpus['bugs']]
+        matcher = BugSummaryMatcher()
+
+        def func():
+            for match in matcher.match_all(bugs, processes=args.processes):
+                pass
+        return (len(bugs), func)
+
+    if stage == 'convert_failure_to_pattern':
+        failures = [bug['failure'] for bug in corpus['bugs']]
+
+        def func():
+            for failure in failures:
+                convert_failure_to_pattern(failure)
+        return (len(failures), func)
+
+    if stage in ('get_test', 'get_test_cached'):
+        failures = get_failures(corpus)
+
+        def func():
+            if stage == 'get_test':
+                get_test.cache_clear()
+            for failure in failures:
+                get_test(failure)
+        return (len(failures), func)
+
+    if stage == 'summarize':
+        summarize_args = get_summarize_args(args)
+        failures = get_failures(corpus)
+
+        def func():
+            get_test.cache_clear()
+            summarize_test_isolation_data(summarize_args, corpus['data'], corpus['bugzilla_data'])
+        return (len(failures), func)
+
+    raise ValueError('Unknown stage %s' % stage)
+
+
+def benchmark_stage(args, corpus, stage):
+    """Return the results for the stage using the best time of
+    args.repeat runs."""
+    (items, func) = run_stage(args, corpus, stage)
+    seconds = None
+    for irepeat in range(args.repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    logger.info('%s: %d items in %.4f seconds', stage, items, seconds)
+    return {
+        'items': items,
+        'seconds': seconds,
+        'items_per_second': items / seconds if seconds > 0 else None,
+    }
+
+
+def find_regressions(args, results, baseline):
+    """Return a list of messages describing the stages whose throughput
+    dropped by more than args.max_regression compared to the baseline."""
+    regressions = []
+    for stage in results:
+        if stage not in baseline:
+            continue
+        baseline_rate = baseline[stage]['items_per_second']
+        rate = results[stage]['items_per_second']
+        if not baseline_rate or not rate:
+            continue
+        change = (rate - baseline_rate) / baseline_rate
+        if change < -args.max_regression:
+            regressions.append('%s: %.1f items/second is %.0f%% slower than baseline %.1f' % (
+                stage, rate, -100 * change, baseline_rate))
+    return regressions
+
+
+def main():
+    """main"""
+
+    parent_parsers = [log_level_args.get_parser()]
+
+    additional_descriptions = [parser.description for parser in parent_parsers
+                               if parser.description]
+    additional_epilogs = [parser.epilog for parser in parent_parsers if parser.epilog]
+
+    parser = argparse.ArgumentParser(
+        description="""
+Benchmark the throughput of the stages used to match bugs to test
+isolation failures, writing results as json to stdout.
+
+The stages are match_bug_summary
+(bugzilla_matching.match_bug_summary_to_mozharness_failure),
+match_bug_summary_batch (bugzilla_matching.BugSummaryMatcher.match_all
+using --processes worker processes), convert_failure_to_pattern, get_test with an empty and a warm cache and
+summarize (summarize_test_isolation_data) from
+summarize_isolation_pushes_jobs_json.py.
+
+The benchmarks run on a synthetic corpus of bug summaries, initial
+comments and bugzilla suggestions generated from --seed which does not
+contain any real bug or test data. A corpus can be saved with
+--save-corpus and reused with --corpus.
+
+%s
+
+""" % '\n\n'.join(additional_descriptions),
+        formatter_class=ArgumentFormatter,
+        epilog="""
+%s
+
+If --baseline is specified, the results are compared to the results of
+a previous run and the exit status is 1 if the throughput of any stage
+dropped by more than --max-regression.
+
+You can save a set of arguments to a file and specify them later using
+the @argfile syntax. The arguments contained in the file will replace
+@argfile in the command line. Multiple files can be loaded into the
+command line through the use of the @ syntax.
+
+Each argument and its value must be on separate lines in the file.
+
+""" % '\n\n'.join(additional_epilogs),
+        parents=parent_parsers,
+        fromfile_prefix_chars='@'
+    )
+
+    parser.add_argument(
+        '--stage',
+        dest='stages',
+        action='append',
+        choices=STAGES,
+        help='Stage to benchmark. May be specified multiple times. '
+        'Defaults to all stages.')
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Number of times each stage is run. The best time is reported.')
+
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        help='Number of worker processes used by match_bug_summary_batch.')
+
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=1,
+        help='Random seed used to generate the synthetic corpus.')
+
+    parser.add_argument(
+        '--revisions',
+        type=int,
+        default=20,
+        help='Number of revisions in the synthetic corpus.')
+
+    parser.add_argument(
+        '--job-types',
+        type=int,
+        default=3,
+        help='Number of job types, each with one bug, per revision.')
+
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=5,
+        help='Number of jobs per isolation section.')
+
+    parser.add_argument(
+        '--suggestions',
+        type=int,
+        default=40,
+        help='Maximum number of bugzilla suggestions per job.')
+
+    parser.add_argument(
+        '--tests',
+        type=int,
+        default=2000,
+        help='Number of distinct tests used in failures.')
+
+    parser.add_argument(
+        '--comment-lines',
+        type=int,
+        default=50,
+        help='Number of mozharness log lines in each initial comment.')
+
+    parser.add_argument(
+        '--corpus',
+        default=None,
+        help='Load the corpus from this json file instead of generating it.')
+
+    parser.add_argument(
+        '--save-corpus',
+        default=None,
+        help='Save the corpus to this json file.')
+
+    parser.add_argument(
+        '--baseline',
+        default=None,
+        help='json file containing the results of a previous run.')
+
+    parser.add_argument(
+        '--max-regression',
+        type=float,
+        default=0.2,
+        help='Maximum allowed fractional drop in throughput compared to '
+        'the baseline.')
+
+    parser.add_argument(
+        '--raw',
+        action='store_true',
+        default=False,
+        help='Do not reformat/indent json.')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level))
+    logger.debug("main %s", args)
+
+    if args.corpus:
+        with open(args.corpus) as corpus_file:
+            corpus = json.load(corpus_file)
+    else:
+        corpus = generate_corpus(args)
+
+    if args.save_corpus:
+        with open(args.save_corpus, 'w') as corpus_file:
+            json.dump(corpus, corpus_file)
+
+    results = {}
+    for stage in args.stages or STAGES:
+        results[stage] = benchmark_stage(args, corpus, stage)
+
+    if args.raw:
+        json.dump(results, sys.stdout)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = find_regressions(args, results, baseline)
+        for regression in regressions:
+            logger.error('Regression %s', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,55 +3,107 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import copy
+import collections
+import concurrent.futures
 import logging
 import re
 
 logger = logging.getLogger(__name__)
 
 
-def match_bug_summary_to_mozharness_failure(bug_summary, initial_comment):
-    """We have seveal scenarios here.
-
-    We start with a bug filed by a sheriff or someone using the
-    Treeherder bug filing system.
-
-    The bug's summary may contain a munged version of the test failure.
-
-    1. We want to use this bug summary to search the first comment made by
-    the bug filer looking for the actual failure in the included
-    mozharness logs lines.
-
-    We don't need to filter the variable items in the summary since the
-    mozharness log lines in the bug will be exact matches even for the
-    variable parts of the failure message.
-
-    From this we want to find the exact failure from the original
-    mozharness log and then determine the test name if possible and then
-    create a reduced failure message that can be used to search for the
-    same failure in different jobs. In this case we will need to deal with
-    the variable aspects of the failure message.
+class MozharnessLineIndex(object):
+    """Index of the mozharness lines from a bug comment which finds the
+    lines containing a token without scanning all of the lines.
 
-    Strategy:
-
-    1. bug summary is a " | " delimited list.
-
-    break summary into parts.
-
-    find matches in the mozharness output for each of the parts.
+    word_lines maps each space delimited word to the set of indexes of
+    the lines containing it. A line can only contain a token if it
+    contains the token's interior words, i.e. all but the first and
+    last which may be partial words in the line, so only those lines
+    need to be checked.
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        self.word_lines = collections.defaultdict(set)
+        for (iline, line) in enumerate(lines):
+            for word in line.split(' '):
+                self.word_lines[word].add(iline)
+        self.matches = {}
+
+    def find(self, token):
+        """Return the set of lines which contain token. The set must
+        not be modified."""
+        if token in self.matches:
+            return self.matches[token]
+        interior_words = set(token.split(' ')[1:-1])
+        if interior_words:
+            word_line_sets = sorted(
+                [self.word_lines.get(word, set()) for word in interior_words], key=len)
+            candidate_lines = sorted(word_line_sets[0].intersection(*word_line_sets[1:]))
+        else:
+            candidate_lines = range(len(self.lines))
+        match_set = set([self.lines[iline] for iline in candidate_lines
+                         if token in self.lines[iline]])
+        self.matches[token] = match_set
+        return match_set
+
+
+def find_longest_token_match(line_index, token, forward):
+    """Return a tuple (token, match_set) for the longest part of token
+    which is contained in the lines of line_index, where words are
+    removed from the end of the token or from the start if forward is
+    True. Parts shorter than 10 characters other than the token itself
+    are ignored. Returns (None, set()) if there is no match.
+
+    A part containing k words contains the part with k-1 words, so if
+    a part matches a line so do all of the shorter parts and the
+    longest matching part can be found with a binary search over the
+    number of words.
+    """
+    words = token.split(' ')
+    nwords = len(words)
+
+    def get_part(k):
+        if forward:
+            return ' '.join(words[nwords - k:])
+        return ' '.join(words[:k])
+
+    match_set = line_index.find(token)
+    if match_set:
+        return (token, match_set)
+
+    # Find the smallest number of words giving a part of at least 10
+    # characters. Shorter parts are ignored.
+    low = 1
+    high = nwords - 1
+    while low <= high and len(get_part(low)) < 10:
+        low += 1
+
+    (match_token, match_set) = (None, set())
+    while low <= high:
+        middle = (low + high) // 2
+        part = get_part(middle)
+        part_match_set = line_index.find(part)
+        if part_match_set:
+            (match_token, match_set) = (part, part_match_set)
+            low = middle + 1
+        else:
+            high = middle - 1
+    return (match_token, match_set)
 
-    If a part has no matches, then remove either a leading word or
-    trailing word and look for matches again until we get a non-empty set.
 
-    # See treeherder/model/error_summary.py for info on bug suggestions
+class BugSummaryMatcher(object):
+    """Match bug summaries to the mozharness failure lines in the bugs'
+    initial comments.
 
+    The patterns are compiled once and shared by all of the matches.
+    match_all matches many bugs, optionally in parallel worker
+    processes.
     """
     # bug summary usually contains an edited version of the failure
     # bugs/635373-3.html == bugs/635373-3-ref.html | ...
     # convert this to bugs/635373-3.html | ...
     REFTEST_RE = re.compile(r'\s+[=!]=\s+[^|]+')
 
-
     # Patterns used to remove or replace text in the bug summary.
     # which might have been edited by the bug filer.
     bugzilla_summary_munge_res = [
@@ -63,122 +115,182 @@ def match_bug_summary_to_mozharness_failure(bug_summary, initial_comment):
         (re.compile(r'Tier 2 ', flags=re.IGNORECASE), ''),
         (re.compile(r'fission '), ''),
     ]
-    munged_bug_summary = bug_summary
-    for regx, replacement in bugzilla_summary_munge_res:
-        match = regx.search(munged_bug_summary)
-        if match:
-            munged_bug_summary = munged_bug_summary.replace(match.group(0), replacement)
 
-    # Collect the mozharness lines from the comment and
-    # remove the  mozharness and taskcluster prefixes
     MOZHARNESS_RE = re.compile(
         r'.*\d+:\d+:\d+[ ]+(?:DEBUG|INFO|WARNING|ERROR|CRITICAL|FATAL) - [ ]?'
     )
 
     OUTPUT_RE = re.compile(r'\s*(?:GECKO\(\d+\)|PID \d+)\s*$')
     RESULT_RE = re.compile(r'(TEST|PROCESS)-')
-
-    # Check for the case where [task does not start a new line
-    # and insert a newline prior to [task.
     INTERIOR_TASK_RE = re.compile(r'([^\n])\[task', re.MULTILINE)
-    interior_task_match = INTERIOR_TASK_RE.search(initial_comment)
-    while interior_task_match:
-        initial_comment = INTERIOR_TASK_RE.sub(interior_task_match.group(1) + '\n[task',
-                                               initial_comment)
-        interior_task_match = INTERIOR_TASK_RE.search(initial_comment)
-
-    mozharness_lines = []
-    for raw_line in initial_comment.split('\n'):
-        if MOZHARNESS_RE.match(raw_line):
-            mozharness_lines.append(MOZHARNESS_RE.sub('', raw_line))
-
-    tokens = munged_bug_summary.split(' | ')
-    if OUTPUT_RE.search(tokens[0]):
-        tokens = tokens[1:]
-
-    # result | test | message implies at most 3 elements unless
-    # the bug filer has added additonal clauses to the summary.
-    # Convert the last token into the join of the extra tokens
-    # so that they are not considered independently.
-    # test | message implies at most 2 elements unless additional
-    # clauses were added. Again convert the last token.
-    # This will result in preferentially matching the first clause
-    # over other clauses added at the end.
-    # An exception to this is when we have a crash-check failure
-    # REFTEST TEST-UNEXPECTED-FAIL | file:///Z:/task_1562891058/build/tests/reftest/tests/image/test/reftest/downscaling/downscale-moz-icon-1.html == file:///Z:/task_1562891058/build/tests/reftest/tests/image/test/reftest/downscaling/downscale-moz-icon-1-ref.html | crash-check | This test left crash dumps behind, but we weren't expecting it to!
-    # but we will handle this case ok.
-
-    if RESULT_RE.search(tokens[0]):
-        if len(tokens) > 3:
-            tokens = tokens[:2] + [' | '.join(tokens[2:])]
-    else:
-        if len(tokens) > 2:
-            tokens = tokens[:1] + [' | '.join(tokens[1:])]
-
-    # Create a list of strings to hold the tokens which matched mozharness lines
-    match_tokens = [None for i in range(len(tokens))]
-
-    # Create a list of sets to hold matching mozharness lines for each of the tokens
-    token_match_sets = [set() for i in range(len(tokens))]
-
-    # We operate in two phases: Forwards and Backwards.
-    # Forwards is when we are removing words from front of the token.
-    # Backwards is when we are removing words from the back of the token.
-
-    for phase in ('backward', 'forward', ):
-        if phase == 'backward':
-            slice_start = 0
-            slice_stop = -1
+
+    def match_all(self, bugs, processes=1, chunksize=16):
+        """Return an iterator over the matched failures for each
+        (bug_summary, initial_comment) in bugs, in order. If processes
+        is greater than 1, the bugs are matched in a pool of processes
+        worker processes and sent to them chunksize bugs at a time.
+        """
+        if processes <= 1:
+            for (bug_summary, initial_comment) in bugs:
+                yield self.match(bug_summary, initial_comment)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            for match in executor.map(self.match_bug, bugs, chunksize=chunksize):
+                yield match
+
+    def match_bug(self, bug):
+        """Return the matched failure for bug, a tuple
+        (bug_summary, initial_comment)."""
+        return self.match(*bug)
+
+    def match(self, bug_summary, initial_comment):
+        """We have seveal scenarios here.
+
+        We start with a bug filed by a sheriff or someone using the
+        Treeherder bug filing system.
+
+        The bug's summary may contain a munged version of the test failure.
+
+        1. We want to use this bug summary to search the first comment made by
+        the bug filer looking for the actual failure in the included
+        mozharness logs lines.
+
+        We don't need to filter the variable items in the summary since the
+        mozharness log lines in the bug will be exact matches even for the
+        variable parts of the failure message.
+
+        From this we want to find the exact failure from the original
+        mozharness log and then determine the test name if possible and then
+        create a reduced failure message that can be used to search for the
+        same failure in different jobs. In this case we will need to deal with
+        the variable aspects of the failure message.
+
+        Strategy:
+
+        1. bug summary is a " | " delimited list.
+
+        break summary into parts.
+
+        find matches in the mozharness output for each of the parts.
+
+        If a part has no matches, then remove either a leading word or
+        trailing word and look for matches again until we get a non-empty set.
+
+        # See treeherder/model/error_summary.py for info on bug suggestions
+
+        """
+        munged_bug_summary = bug_summary
+        for regx, replacement in self.bugzilla_summary_munge_res:
+            match = regx.search(munged_bug_summary)
+            if match:
+                munged_bug_summary = munged_bug_summary.replace(match.group(0), replacement)
+
+        # Collect the mozharness lines from the comment and
+        # remove the  mozharness and taskcluster prefixes.
+        # Check for the case where [task does not start a new line
+        # and insert a newline prior to [task.
+        if '[task' in initial_comment:
+            interior_task_match = self.INTERIOR_TASK_RE.search(initial_comment)
+            while interior_task_match:
+                initial_comment = self.INTERIOR_TASK_RE.sub(
+                    interior_task_match.group(1) + '\n[task', initial_comment)
+                interior_task_match = self.INTERIOR_TASK_RE.search(initial_comment)
+
+        mozharness_lines = []
+        for raw_line in initial_comment.split('\n'):
+            mozharness_match = self.MOZHARNESS_RE.match(raw_line)
+            if mozharness_match:
+                mozharness_lines.append(raw_line[mozharness_match.end():])
+        line_index = MozharnessLineIndex(mozharness_lines)
+
+        tokens = munged_bug_summary.split(' | ')
+        if self.OUTPUT_RE.search(tokens[0]):
+            tokens = tokens[1:]
+
+        # result | test | message implies at most 3 elements unless
+        # the bug filer has added additonal clauses to the summary.
+        # Convert the last token into the join of the extra tokens
+        # so that they are not considered independently.
+        # test | message implies at most 2 elements unless additional
+        # clauses were added. Again convert the last token.
+        # This will result in preferentially matching the first clause
+        # over other clauses added at the end.
+        # An exception to this is when we have a crash-check failure
+        # REFTEST TEST-UNEXPECTED-FAIL | file:///Z:/task_1562891058/build/tests/reftest/tests/image/test/reftest/downscaling/downscale-moz-icon-1.html == file:///Z:/task_1562891058/build/tests/reftest/tests/image/test/reftest/downscaling/downscale-moz-icon-1-ref.html | crash-check | This test left crash dumps behind, but we weren't expecting it to!
+        # but we will handle this case ok.
+
+        if self.RESULT_RE.search(tokens[0]):
+            if len(tokens) > 3:
+                tokens = tokens[:2] + [' | '.join(tokens[2:])]
         else:
-            slice_start = 1
-            slice_stop = None
-
-        for itoken in range(len(tokens)):
-            token = tokens[itoken]
-            token_match_set = token_match_sets[itoken]
-
-            while token and not token_match_set:
-                token_match_set = set([line for line in mozharness_lines if token in line])
-                if not token_match_set:
-                    token = ' '.join(token.split(' ')[slice_start:slice_stop:1])
-                    # Ignore short tokens
-                    if len(token) < 10:
-                        token = ''
-                else:
-                    match_tokens[itoken] = token
+            if len(tokens) > 2:
+                tokens = tokens[:1] + [' | '.join(tokens[1:])]
+
+        # Create a list of strings to hold the tokens which matched mozharness lines
+        match_tokens = [None for i in range(len(tokens))]
+
+        # Create a list of sets to hold matching mozharness lines for each of the tokens
+        token_match_sets = [set() for i in range(len(tokens))]
+
+        # We operate in two phases: Forwards and Backwards.
+        # Forwards is when we are removing words from front of the token.
+        # Backwards is when we are removing words from the back of the token.
+
+        for phase in ('backward', 'forward', ):
+            for itoken in range(len(tokens)):
+                token = tokens[itoken]
+                if not token or token_match_sets[itoken]:
+                    continue
+                (match_token, token_match_set) = find_longest_token_match(
+                    line_index, token, phase == 'forward')
+                if token_match_set:
+                    match_tokens[itoken] = match_token
                     token_match_sets[itoken] = token_match_set
 
-    candidate_sets = copy.deepcopy(token_match_sets)
-
-    # Sort the list of candidated sets by descending count of
-    # their elements.
-    candidate_sets.sort(key=len, reverse=True)
-
-    result_set = candidate_sets[0]
-    for iset in range(1, len(candidate_sets)):
-        candidate_set = candidate_sets[iset]
-        # Clean the candidate set of extraneous TEST- messages
-        lines_to_be_removed = set()
-        for candidate_line in candidate_set:
-            if 'TEST-' in candidate_line and not 'UNEXPECTED' in candidate_line:
-                lines_to_be_removed.add(candidate_line)
-        candidate_set.difference_update(lines_to_be_removed)
-        if candidate_set:
-            # Ignore empty sets.
-            result_set.intersection_update(candidate_set)
-
-    if len(result_set) == 1:
-        match = result_set.pop()
-    else:
-        # Multiple matches. Iterate through the matches returning the
-        # first to contain the bug summary.
-        match = None
-        while result_set:
-            candidate_match = result_set.pop()
-            if munged_bug_summary in candidate_match:
-                match = candidate_match
-                break
-    if match:
-        match = match.strip()
-    return match
+        # The match sets are shared with line_index so copy them before
+        # they are modified. Copy them from lists as deepcopy did so the
+        # sets iterate in the same order when choosing between multiple
+        # matches below.
+        candidate_sets = [set(list(token_match_set)) for token_match_set in token_match_sets]
+
+        # Sort the list of candidated sets by descending count of
+        # their elements.
+        candidate_sets.sort(key=len, reverse=True)
+
+        result_set = candidate_sets[0]
+        for iset in range(1, len(candidate_sets)):
+            candidate_set = candidate_sets[iset]
+            # Clean the candidate set of extraneous TEST- messages
+            lines_to_be_removed = set()
+            for candidate_line in candidate_set:
+                if 'TEST-' in candidate_line and not 'UNEXPECTED' in candidate_line:
+                    lines_to_be_removed.add(candidate_line)
+            candidate_set.difference_update(lines_to_be_removed)
+            if candidate_set:
+                # Ignore empty sets.
+                result_set.intersection_update(candidate_set)
+
+        if len(result_set) == 1:
+            match = result_set.pop()
+        else:
+            # Multiple matches. Iterate through the matches returning the
+            # first to contain the bug summary.
+            match = None
+            while result_set:
+                candidate_match = result_set.pop()
+                if munged_bug_summary in candidate_match:
+                    match = candidate_match
+                    break
+        if match:
+            match = match.strip()
+        return match
+
+
+BUG_SUMMARY_MATCHER = BugSummaryMatcher()
 
+
+def match_bug_summary_to_mozharness_failure(bug_summary, initial_comment):
+    """Return the mozharness failure line from initial_comment matching
+    bug_summary or None. See BugSummaryMatcher.match."""
+    return BUG_SUMMARY_MATCHER.match(bug_summary, initial_comment)
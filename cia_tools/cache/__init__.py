@@ -27,11 +27,13 @@ objects.
 import os
 import json
 import logging
+import tempfile
+import time
 
 CACHE_HOME = "/tmp/mozilla-cia-tools-cache"
 CACHE_STATS = {}
 
-def load(attributes, name):
+def load(attributes, name, max_age=None):
     """Return the contents of the file located at the cached location for
     the object specified by the attributes and name if it exists
     otherwise return None.
@@ -41,6 +43,9 @@ def load(attributes, name):
 
     name:       string or int filename of object.
 
+    max_age:    optional number of seconds after which the cached object
+                is considered stale and is treated as missing.
+
     """
     assert CACHE_HOME, 'CACHE location not set.'
 
@@ -50,7 +55,8 @@ def load(attributes, name):
     path = os.path.join(CACHE_HOME, *(attributes + [name]))
     if path not in CACHE_STATS:
         CACHE_STATS[path] = {'miss': 0, 'hit': 0}
-    if os.path.isfile(path):
+    if os.path.isfile(path) and (
+            max_age is None or time.time() - os.path.getmtime(path) < max_age):
         if path in CACHE_STATS:
             CACHE_STATS[path]['hit'] += 1
         with open(path) as datafile:
@@ -75,16 +81,24 @@ def save(attributes, name, data):
 
     directory = os.path.join(CACHE_HOME, *attributes)
     if not os.path.isdir(directory):
-        os.makedirs(directory)
+        os.makedirs(directory, exist_ok=True)
     if type(name) != str:
         name = str(name)
     assert '/' not in name, 'Cached object {}/{} contains /'.format(directory, name)
     path = os.path.join(directory, name)
     if path not in CACHE_STATS:
         CACHE_STATS[path] = {'miss': 0, 'hit': 0}
-    with open(path, mode='w+b') as datafile:
-        CACHE_STATS[path]['hit'] += 1
-        datafile.write(bytes(data, 'utf-8'))
+    # Write to a temporary file which replaces the cached object so
+    # that concurrent readers never see a partially written file.
+    (fd, temp_path) = tempfile.mkstemp(dir=directory, prefix='.' + name + '.')
+    try:
+        with os.fdopen(fd, mode='w+b') as datafile:
+            CACHE_STATS[path]['hit'] += 1
+            datafile.write(bytes(data, 'utf-8'))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
 
 
 def stats():
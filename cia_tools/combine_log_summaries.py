@@ -4,24 +4,51 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import argparse
+import collections
+import concurrent.futures
+import functools
+import heapq
+import io
+import itertools
 import json
 import logging
+import operator
 import re
 import sys
 
 from numbers import Number
 
+import json_stream
+
 from common_args import ArgumentFormatter, log_level_args
 
 
 logger = None
 
+
+@functools.lru_cache(maxsize=None)
+def is_ignored(re_ignore, key):
+    """Return True if key matches re_ignore. The result is cached since
+    the same keys occur in every alias and at every level compared."""
+    return bool(re_ignore and re_ignore.search(key))
+
+
+def get_item_name(item):
+    """Return the name used to pair the items of lists of dicts. Assume
+    the dicts are keyed by name which is the case for perfherder. If
+    name is not available, attempt framework."""
+    item_name = item.get('name', None)
+    if not item_name:
+        framework = item.get('framework', None)
+        if framework:
+            item_name = framework['name']
+    return item_name
+
+
 def compare_aliases(re_ignore, alias_names, data):
     combined_keys = list(data["combined"].keys())
     combined_keys.sort()
 
-    naliases = len(alias_names)
-
     comparison = {
         "aliases": data["aliases"],
         "differences": {},
@@ -30,32 +57,46 @@ def compare_aliases(re_ignore, alias_names, data):
     differences = comparison["differences"]
 
     for key in combined_keys:
-        if re_ignore:
-            match = re_ignore.search(key)
-            if match:
-                continue
-        l = 0
-        while l+1 < naliases:
-            r = l + 1
-            l_alias_name = alias_names[l]
-            r_alias_name = alias_names[r]
-
-            l_data = data["combined"][key].get(l_alias_name, None)
-            r_data = data["combined"][key].get(r_alias_name, None)
-            difference = generate_difference(re_ignore, l_data, r_data)
-            if difference:
-                if key not in differences:
-                    differences[key] = {}
-                lr_key = 'compare alias %s to %s' % (l_alias_name, r_alias_name)
-                if lr_key in differences[key]:
-                    raise ValueError("%s in differences[%s]: %s" %
-                                     lr_key, key, differences[key])
-                differences[key][lr_key] = difference
-            l += 1
+        if is_ignored(re_ignore, key):
+            continue
+        key_difference = compare_key_aliases(re_ignore, alias_names, key, data["combined"][key])
+        if key_difference:
+            differences[key] = key_difference
 
     return comparison
 
 
+def compare_key_aliases(re_ignore, alias_names, key, alias_data):
+    """Return the differences between the values of key for each pair
+    of consecutive aliases where alias_data maps alias names to the
+    values of key. The values of each pair are compared by
+    generate_difference.
+    """
+    # The values of the key for each of the aliases.
+    key_data = [alias_data.get(alias_name, None) for alias_name in alias_names]
+    naliases = len(alias_names)
+
+    differences = {}
+    l = 0
+    while l+1 < naliases:
+        r = l + 1
+        l_alias_name = alias_names[l]
+        r_alias_name = alias_names[r]
+
+        l_data = key_data[l]
+        r_data = key_data[r]
+        difference = generate_difference(re_ignore, l_data, r_data)
+        if difference:
+            lr_key = 'compare alias %s to %s' % (l_alias_name, r_alias_name)
+            if lr_key in differences:
+                raise ValueError("%s in differences[%s]: %s" %
+                                 lr_key, key, differences)
+            differences[lr_key] = difference
+        l += 1
+
+    return differences
+
+
 def _handle_simple_difference(difference, parent_key, re_ignore, left, right):
     """Handle the case where left == right or one of left or right is a
     dict and the other is None.
@@ -67,33 +108,28 @@ def _handle_simple_difference(difference, parent_key, re_ignore, left, right):
     """
     handled = True
     child_difference = {}
+    lists_equal = False
 
     if type(left) == list and type(right) == list:
         child_difference = []
         if parent_key == 'replicates':
             # Explicitly handle perfherder replicates.
             handled = True
-            for i in range(len(left)):
-                try:
-                    child_difference.append(left[i] - right[i])
-                except IndexError:
-                    child_difference.append(left[i])
+            child_difference = get_replicates_difference(left, right)
         else:
+            # Compare lists as multisets ignoring the order of the items.
             try:
-                left.sort()
-                right.sort()
+                lists_equal = collections.Counter(left) == collections.Counter(right)
             except TypeError:
-                pass  # XXX items in the list are not sortable.
+                pass  # XXX items in the list are not hashable.
 
-    if left == right:
+    if lists_equal or left == right:
         pass
     elif right is None and type(left) == dict:
         right_value = None
         for key in left.keys():
-            if re_ignore:
-                match = re_ignore.search(key)
-                if match:
-                    continue
+            if is_ignored(re_ignore, key):
+                continue
             left_value = left[key]
             if type(left_value) == dict:
                 _handle_simple_difference(child_difference, key, re_ignore, left_value, right_value)
@@ -104,10 +140,8 @@ def _handle_simple_difference(difference, parent_key, re_ignore, left, right):
     elif left is None and type(right) == dict:
         left_value = None
         for key in right.keys():
-            if re_ignore:
-                match = re_ignore.search(key)
-                if match:
-                    continue
+            if is_ignored(re_ignore, key):
+                continue
             right_value = right[key]
             if type(right_value) == dict:
                 _handle_simple_difference(child_difference, key, re_ignore, left_value, right_value)
@@ -135,6 +169,80 @@ def _handle_simple_difference(difference, parent_key, re_ignore, left, right):
     return handled
 
 
+def get_replicates_difference(left, right):
+    """Return the element-wise difference of the perfherder replicates
+    in left and right. Elements of left without a corresponding
+    element in right are returned unchanged."""
+    difference = [left_item - right_item for (left_item, right_item) in zip(left, right)]
+    difference.extend(left[len(right):])
+    return difference
+
+
+def sort_if_possible(items):
+    """Return items sorted if they are orderable, otherwise unchanged."""
+    try:
+        return sorted(items)
+    except TypeError:
+        return items
+
+
+def get_multiset_difference(left_value, right_value):
+    """Return the difference between the lists left_value and
+    right_value treated as multisets: the items occurring more often in
+    left_value followed by the items occurring more often in
+    right_value prefixed with !. Each item is repeated by the
+    difference in its counts. Raise TypeError if the items are not
+    hashable."""
+    left_counts = collections.Counter(left_value)
+    right_counts = collections.Counter(right_value)
+    difference = sort_if_possible(list((left_counts - right_counts).elements()))
+    difference.extend(["!%s" % item for item in
+                       sort_if_possible(list((right_counts - left_counts).elements()))])
+    return difference
+
+
+def generate_list_of_dicts_difference(re_ignore, left_value, right_value):
+    """Return the list of differences between the dicts in left_value
+    and the dicts in right_value with the same name.
+
+    Each left item is paired with the first unpaired right item with
+    the same name using an index of the right items by name. Left
+    items without a name are compared to None, left items without a
+    matching right item are ignored and unpaired right items are
+    compared to None. The lists are not modified since the same values
+    are compared for each pair of aliases.
+    """
+    key_difference = []
+
+    right_indexes = collections.defaultdict(collections.deque)
+    for (rindex, right_value_item) in enumerate(right_value):
+        right_indexes[get_item_name(right_value_item)].append(rindex)
+    paired_rindexes = set()
+
+    for left_value_item in left_value:
+        left_value_item_name = get_item_name(left_value_item)
+        if left_value_item_name is None:
+            # Note we compare against None here since some perfherder data
+            # can contain an empty string for the name.
+            logging.getLogger().warning("Could not get left_value_name")
+            key_difference.append(generate_difference(re_ignore, left_value_item, None))
+            continue
+        rindexes = right_indexes.get(left_value_item_name)
+        if rindexes:
+            rindex = rindexes.popleft()
+            paired_rindexes.add(rindex)
+            left_right_difference = generate_difference(re_ignore, left_value_item,
+                                                        right_value[rindex])
+            if left_right_difference:
+                key_difference.append(left_right_difference)
+
+    for (rindex, right_value_item) in enumerate(right_value):
+        if rindex not in paired_rindexes:
+            key_difference.append(generate_difference(re_ignore, None, right_value_item))
+
+    return key_difference
+
+
 def generate_difference(re_ignore, left, right):
     logger = logging.getLogger()
     difference = {}
@@ -142,10 +250,8 @@ def generate_difference(re_ignore, left, right):
         return difference
 
     for key in left.keys():
-        if re_ignore:
-            match = re_ignore.search(key)
-            if match:
-                continue
+        if is_ignored(re_ignore, key):
+            continue
         left_value = left[key]
         right_value = right.get(key, None)
 
@@ -169,65 +275,14 @@ def generate_difference(re_ignore, left, right):
         elif type(left_value) == list:
             if key == 'replicates':
                 # Explicitly handle perfherder replicates.
-                key_difference = []
-                for i in range(len(left_value)):
-                    try:
-                        key_difference.append(left_value[i] - right_value[i])
-                    except IndexError:
-                        key_difference.append(left_value[i])
+                key_difference = get_replicates_difference(left_value, right_value)
             else:
                 try:
-                    left_set = set(left_value)
-                    right_set = set(right_value)
-                    key_difference = list(left_set - right_set)
-                    both_set = left_set.intersection(right_set)
-                    key_difference.extend(["!%s" % r for r in right_set - both_set])
+                    key_difference = get_multiset_difference(left_value, right_value)
                 except TypeError:
                     # XXX items in the list are not hashable
-                    key_difference = []
-                    while left_value:
-                        left_value_item = left_value.pop(0)
-                        # assume the dicts are keyed by name which is the
-                        # case for perfherder. First attempt to find the pair
-                        # left_value_item['name'] == right_value[rindex]['name']
-                        left_value_item_name = left_value_item.get('name', None)
-                        # If name is not available, attempt framework...
-                        if not left_value_item_name:
-                            framework = left_value_item.get('framework', None)
-                            if framework:
-                                left_value_item_name = framework['name']
-                        right_value_item_name = None
-                        if left_value_item_name is None:
-                            # Note we compare against None here since some perfherder data
-                            # can contain an empty string for the name.
-                            logger.warning("Could not get left_value_name")
-                            key_difference.append(generate_difference(re_ignore, left_value_item, None))
-                        else:
-                            # find the right_value item which has the same name value
-                            rindex = -1
-                            for right_value_item in right_value:
-                                rindex +=1
-                                right_value_item_name = right_value_item.get('name', None)
-                                if not right_value_item_name:
-                                    framework = right_value_item.get('framework', None)
-                                    if framework:
-                                        right_value_item_name = framework['name']
-                                if left_value_item_name == right_value_item_name:
-                                    break
-                            if left_value_item_name == right_value_item_name:
-                                del right_value[rindex]
-                                left_right_difference = generate_difference(re_ignore, left_value_item, right_value_item)
-                                if left_right_difference:
-                                    key_difference.append(left_right_difference)
-                            #else:
-                            #    # No name key, just do the list items in order
-                            #    try:
-                            #        right_value_item = right_value.pop(0)
-                            #    except IndexError:
-                            #        right_value_item = None
-                    while right_value:
-                        right_value_item = right_value.pop(0)
-                        key_difference.append(generate_difference(re_ignore, None, right_value_item))
+                    key_difference = generate_list_of_dicts_difference(
+                        re_ignore, left_value, right_value)
             if key_difference:
                 difference[key] = key_difference
         else:
@@ -237,63 +292,235 @@ def generate_difference(re_ignore, left, right):
     for key in right.keys():
         if key in left:
             continue
-        if re_ignore:
-            match = re_ignore.search(key)
-            if match:
-                continue
+        if is_ignored(re_ignore, key):
+            continue
         right_value = right[key]
         _handle_simple_difference(difference, key, re_ignore, left_value, right_value)
 
     return difference
 
 
-#@profile
-def munge_test_data(test_data):
-    #re_test_remainder = re.compile(r'([\d]+ [\d]+ [(][\d]+[)]%|[\d]+ / [\d]+ [(][\d]+%[)]|took [\d]+ms|test completed [(]time: [\d]+ms[)]|\[[\d.]+ s\])$')
-    re_test_remainder = re.compile(r'([\d]+ / [\d]+ [(][\d]+%[)]|took [\d]+ms|test completed [(]time: [\d]+ms[)]|\[[\d.]+ s\])$')
-    re_ignorable_test_line = re.compile(r'started process GECKO|Main app process: exit 0')
-    re_javascript_date = re.compile(r'Date[(][\d]+[)]')
-    re_talos_process_1 = re.compile(r'[\d]+: exit ([\d]+)')
-    re_talos_process_2 = re.compile(r'started process [\d]+')
-    re_dom_media = re.compile(r'\[((?:started|finished).*)t=[\d.]+\]')
-    re_mochitest_guid = re.compile(r'should have a guid - "[a-z0-9]+"')
-    re_paths = re.compile(r'(file:///builds/worker/workspace/build/|z:\\build\\build\\src\\)')
-    re_task = re.compile(r'task_[0-9]+')
-    re_localhost = re.compile(r'http://localhost:[\d]+/[\d]+/[\d]+/')
+re_test_remainder = re.compile(r'([\d]+ / [\d]+ [(][\d]+%[)]|took [\d]+ms|test completed [(]time: [\d]+ms[)]|\[[\d.]+ s\])$')
+re_javascript_date = re.compile(r'Date[(][\d]+[)]')
+re_talos_process_1 = re.compile(r'[\d]+: exit ([\d]+)')
+re_talos_process_2 = re.compile(r'started process [\d]+')
+re_dom_media = re.compile(r'\[((?:started|finished).*)t=[\d.]+\]')
+re_dom_media_time = re.compile(r't=[\d.]+')
+re_mochitest_guid = re.compile(r'should have a guid - "[a-z0-9]+"')
+re_paths = re.compile(r'(file:///builds/worker/workspace/build/|z:\\build\\build\\src\\)')
+re_task = re.compile(r'task_[0-9]+')
+re_localhost = re.compile(r'http://localhost:[\d]+/[\d]+/[\d]+/')
+
+# Lines containing any of these are removed.
+IGNORABLE_TEST_LINES = ('started process GECKO', 'Main app process: exit 0')
+
+# The trailing stats removed by re_test_remainder end with one of these.
+TEST_REMAINDER_ENDINGS = ('ms', ')', ']')
+
+
+def munge_talos_process_exit(test_line):
+    match = re_talos_process_1.search(test_line)
+    if match:
+        test_line = test_line.replace(match.group(0), '9999: exit %s' % match.group(1))
+    return test_line
+
+
+def munge_dom_media_time(test_line):
+    if re_dom_media.search(test_line):
+        test_line = re_dom_media_time.sub('t=...', test_line)
+    return test_line
+
+
+# The rules used to munge the test lines, applied in order. Each rule
+# is a tuple (literal, munge) where munge is only called for lines
+# containing literal since the rule can not apply to other lines.
+TEST_LINE_MUNGE_RULES = (
+    ('build', functools.partial(re_paths.sub, '')),
+    ('task_', functools.partial(re_task.sub, 'task')),
+    ('http://localhost:', functools.partial(re_localhost.sub, 'http://localhost:9999/9999/9/')), # reftest
+    ('Date(', functools.partial(re_javascript_date.sub, 'Date(...)')), # javascript tests.
+    ('started process ', functools.partial(re_talos_process_2.sub, 'started process 9999')), # Talos
+    (': exit ', munge_talos_process_exit),
+    ('t=', munge_dom_media_time),
+    ('should have a guid - "',
+     functools.partial(re_mochitest_guid.sub, 'should have a guid - "0123456789ab"')),
+)
+
+
+@functools.lru_cache(maxsize=65536)
+def munge_test_line(test_line):
+    """Return the munged test_line or None if the line should be
+    removed. The result is cached since the same lines occur in the
+    summaries for each alias."""
+    for ignorable_test_line in IGNORABLE_TEST_LINES:
+        if ignorable_test_line in test_line:
+            return None
+
+    # Remove the trailing stats on the line.
+    if test_line.rstrip('\n').endswith(TEST_REMAINDER_ENDINGS):
+        test_line_parts = test_line.split(' | ')
+        match = re_test_remainder.search(test_line_parts[-1])
+        if match:
+            test_line = ' | '.join(test_line_parts[:-1])
+
+    # munge the test line
+    for (literal, munge) in TEST_LINE_MUNGE_RULES:
+        if literal in test_line:
+            test_line = munge(test_line)
+    return test_line
+
 
+def munge_test_data(test_data):
     for test_status in test_data:
         if 'list' not in test_data[test_status]:
             continue
 
         new_list = []
         for test_line in test_data[test_status]['list']:
-            match = re_ignorable_test_line.search(test_line)
-            if match:
-                continue
-            # Remove the trailing stats on the line.
-            test_line_parts = test_line.split(' | ')
-            match = re_test_remainder.search(test_line_parts[-1])
-            if match:
-                test_line = ' | '.join(test_line_parts[:-1])
-
-            # munge the test line
-            test_line = re_paths.sub('', test_line)
-            test_line = re_task.sub('task', test_line)
-            test_line = re_localhost.sub('http://localhost:9999/9999/9/', test_line) # reftest
-            test_line = 'Date(...)'.join(re_javascript_date.split(test_line)) # javascript tests.
-            test_line = 'started process 9999'.join(re_talos_process_2.split(test_line)) # Talos
-            match = re_talos_process_1.search(test_line)
-            if match:
-                test_line = test_line.replace(match.group(0), '9999: exit %s' % match.group(1))
-            match = re_dom_media.search(test_line)
-            if match:
-                test_line = re.sub('t=[\d.]+', 't=...', test_line)
-            match = re_mochitest_guid.search(test_line)
-            if match:
-                test_line = re_mochitest_guid.sub('should have a guid - "0123456789ab"', test_line)
-            new_list.append(test_line)
+            test_line = munge_test_line(test_line)
+            if test_line is not None:
+                new_list.append(test_line)
         test_data[test_status]['list'] = new_list
 
+
+def munge_job_data(job_data):
+    """Munge the test data of the job in the log summary."""
+    if 'test_data' in job_data:
+        munge_test_data(job_data['test_data'])
+
+
+def scan_summary(input_file_path):
+    """Return a list of tuples (revision, offset, is_sorted) for the
+    revisions in the log summary json file input_file_path where offset
+    is the byte offset of the revision's object in the file and
+    is_sorted is True if the job type names of the revision are in
+    sorted order."""
+    revisions = []
+    with open(input_file_path, encoding='utf-8', newline='') as input_file:
+        reader = json_stream.JSONStreamReader(input_file, encoding='utf-8')
+        for revision in reader.iter_object_keys():
+            reader.peek()
+            offset = reader.tell()
+            is_sorted = True
+            previous_job_type_name = None
+            for job_type_name in reader.iter_object_keys():
+                reader.decode()
+                if previous_job_type_name is not None and job_type_name < previous_job_type_name:
+                    is_sorted = False
+                previous_job_type_name = job_type_name
+            revisions.append((revision, offset, is_sorted))
+    return revisions
+
+
+def iter_summary_jobs(input_file_path, offset):
+    """Yield the (job_type_name, data) pairs of the revision whose
+    object starts at the byte offset in the log summary json file
+    input_file_path one at a time."""
+    with open(input_file_path, 'rb') as input_file:
+        input_file.seek(offset)
+        with io.TextIOWrapper(input_file, encoding='utf-8', newline='') as input_text:
+            for (job_type_name, data) in json_stream.iter_object_items(input_text):
+                yield (job_type_name, data)
+
+
+def iter_alias_jobs(alias, jobs):
+    """Yield (job_type_name, alias, data) for the (job_type_name, data)
+    pairs in jobs."""
+    for (job_type_name, data) in jobs:
+        yield (job_type_name, alias, data)
+
+
+def iter_combined_jobs(input_file_paths, aliases):
+    """Yield (job_type_name, alias_data) pairs in sorted job_type_name
+    order where alias_data maps the alias of each revision to the job's
+    data for the revision.
+
+    The files are merged as streams so only the data for the current
+    job type is held in memory. Each file is scanned once to find the
+    offsets of its revisions and each revision is then streamed from
+    its offset. A revision whose job types are not in sorted order, as
+    when its file was written with --raw, is loaded and sorted in
+    memory. Later files replace the data of earlier files for the same
+    alias.
+    """
+    streams = []
+    for input_file_path in input_file_paths:
+        for (revision, offset, is_sorted) in scan_summary(input_file_path):
+            alias = aliases[revision]
+            stream = iter_summary_jobs(input_file_path, offset)
+            if not is_sorted:
+                logger.warning("job types of %s in %s are not sorted, loading them into memory",
+                               revision, input_file_path)
+                stream = iter(sorted(stream, key=operator.itemgetter(0)))
+            streams.append(iter_alias_jobs(alias, stream))
+
+    merged = heapq.merge(*streams, key=operator.itemgetter(0))
+    for (job_type_name, items) in itertools.groupby(merged, key=operator.itemgetter(0)):
+        alias_data = {}
+        for (job_type_name, alias, data) in items:
+            alias_data[alias] = data
+        yield (job_type_name, alias_data)
+
+
+def process_job(munge, differences, re_ignore, alias_list, job_type_name, alias_data):
+    """Return the output value for job_type_name: the alias_data,
+    munged if munge is True, or the differences between the aliases if
+    differences is True."""
+    if munge:
+        for data in alias_data.values():
+            munge_job_data(data)
+    if differences:
+        return compare_key_aliases(re_ignore, alias_list, job_type_name, alias_data)
+    return alias_data
+
+
+def iter_processed_jobs(process, jobs, executor, window):
+    """Yield (job_type_name, value) pairs for the (job_type_name,
+    alias_data) pairs in jobs where value is process(job_type_name,
+    alias_data). If executor is not None the jobs are processed in its
+    worker processes with at most window jobs pending at a time."""
+    if executor is None:
+        for (job_type_name, alias_data) in jobs:
+            yield (job_type_name, process(job_type_name, alias_data))
+        return
+    pending = collections.deque()
+    for (job_type_name, alias_data) in jobs:
+        pending.append((job_type_name, executor.submit(process, job_type_name, alias_data)))
+        if len(pending) >= window:
+            (job_type_name, future) = pending.popleft()
+            yield (job_type_name, future.result())
+    while pending:
+        (job_type_name, future) = pending.popleft()
+        yield (job_type_name, future.result())
+
+
+def write_indented_json(output_file, value, level):
+    """Write value to output_file as json.dump(indent=2, sort_keys=True)
+    would when value is nested level objects deep."""
+    output_file.write(json.dumps(value, indent=2, sort_keys=True).replace('\n', '\n' + '  ' * level))
+
+
+def write_output(output_file, aliases, name, items):
+    """Write the json object {"aliases": aliases, name: dict(items)}
+    to output_file as it is produced, formatted identically to
+    json.dump(indent=2, sort_keys=True). items must be (key, value)
+    pairs in sorted key order. Items with empty values are omitted
+    if name is "differences"."""
+    output_file.write('{\n  "aliases": ')
+    write_indented_json(output_file, aliases, 1)
+    output_file.write(',\n  %s: {' % json.dumps(name))
+    separator = '\n    '
+    for (key, value) in items:
+        if name == 'differences' and not value:
+            continue
+        output_file.write('%s%s: ' % (separator, json.dumps(key)))
+        write_indented_json(output_file, value, 2)
+        separator = ',\n    '
+    if separator == ',\n    ':
+        output_file.write('\n  ')
+    output_file.write('}\n}')
+
+
 def main():
     global logger
 
@@ -334,50 +561,48 @@ and its value must be on separate lines in the file.""",
                         default=False,
                         help="Modify TEST- lines in output to improve comparibility.")
 
+    parser.add_argument('--processes',
+                        type=int,
+                        default=1,
+                        help="Number of worker processes used to munge and compare the jobs.")
+
     args = parser.parse_args()
 
     logging.basicConfig(level=getattr(logging, args.log_level))
     logger = logging.getLogger()
 
-    combined_data = {
-        "aliases": {},
-        "combined": {}
-    }
-
+    aliases = {}
     alias_list = []
     for aliasmap in args.aliases:
         (key, alias) = aliasmap.split(':')
         alias_list.append(alias)
-        combined_data["aliases"][key] = alias
+        aliases[key] = alias
 
     if args.ignore:
         re_ignore = re.compile(args.ignore)
     else:
         re_ignore = None
 
-    for input_file_path in args.files:
-        with open(input_file_path) as input_file:
-            input_json = json.load(input_file)
-            for key in input_json.keys():
-                data = input_json[key]
-                alias_key = combined_data["aliases"][key]
-
-                sub_keys = data.keys()
-
-                for sub_key in sub_keys:
-                    if args.munge_test_data and 'test_data' in data[sub_key]:
-                        munge_test_data(data[sub_key]['test_data'])
-
-                    if sub_key not in combined_data["combined"]:
-                        combined_data["combined"][sub_key] = {}
-                    combined_data["combined"][sub_key][alias_key] = data[sub_key]
+    jobs = iter_combined_jobs(args.files, aliases)
+    if args.differences:
+        jobs = ((job_type_name, alias_data) for (job_type_name, alias_data) in jobs
+                if not is_ignored(re_ignore, job_type_name))
 
-    if not args.differences:
-        output_data = combined_data
+    process = functools.partial(process_job, args.munge_test_data, args.differences,
+                                re_ignore, alias_list)
+    if args.processes > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.processes)
     else:
-        output_data = compare_aliases(re_ignore, alias_list, combined_data)
+        executor = None
 
-    json.dump(output_data, sys.stdout, indent=2, sort_keys=True)
+    try:
+        output_items = iter_processed_jobs(process, jobs, executor, 4 * args.processes)
+        write_output(sys.stdout, aliases,
+                     "differences" if args.differences else "combined", output_items)
+    finally:
+        if executor:
+            executor.shutdown()
 
 
-main()
+if __name__ == '__main__':
+    main()
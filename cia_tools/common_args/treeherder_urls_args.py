@@ -12,4 +12,18 @@ def get_parser():
         "--treeherder-url",
         default='https://treeherder.mozilla.org',
         help="Treeherder url.")
+
+    parser.add_argument(
+        "--repositories-ttl",
+        type=int,
+        default=86400,
+        help="Number of seconds before the cached Treeherder repositories\n"
+        "are refreshed.")
+
+    parser.add_argument(
+        "--offline",
+        action='store_true',
+        default=False,
+        help="Use the cached Treeherder repositories without checking\n"
+        "Treeherder for updates.")
     return parser
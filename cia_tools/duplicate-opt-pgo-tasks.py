@@ -3,10 +3,11 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import json
 import re
 import sys
 
+import json_stream
+
 re_pattern = re.compile(r'([^/]+)/(opt|pgo)-(.*)')
 opt = set()
 pgo = set()
@@ -16,24 +17,28 @@ if len(sys.argv) == 1:
 else:
     input = open(sys.argv[1])
 
-tasks = json.load(input)
+# Only keep the run_on_projects attribute of the opt and pgo tasks
+# rather than loading the whole taskgraph.
+tasks_run_on_projects = {}
+for (key, task) in json_stream.iter_object_items(input):
+    if not re_pattern.match(key):
+        continue
+    if 'attributes' not in task:
+        continue
+    if 'run_on_projects' not in task['attributes']:
+        continue
+    tasks_run_on_projects[key] = task['attributes']['run_on_projects']
 
-keys = list(tasks.keys())
+keys = list(tasks_run_on_projects.keys())
 keys.sort()
 
 for key in keys:
     match = re_pattern.match(key)
-    if not match:
-        continue
 
     (platform, buildtype, test) = match.groups()
     #if 'android' not in platform or 'raptor' not in test:
     #    continue
-    if 'attributes' not in tasks[key]:
-        continue
-    if 'run_on_projects' not in tasks[key]['attributes']:
-        continue
-    run_on_projects = tasks[key]['attributes']['run_on_projects']
+    run_on_projects = tasks_run_on_projects[key]
     try:
         run_on_projects.remove('try')
     except ValueError:
@@ -88,7 +88,8 @@ Each argument and its value must be on separate lines in the file.
         os.makedirs(args.cache)
     cache.CACHE_HOME = args.cache
 
-    init_treeherder(args.treeherder_url)
+    init_treeherder(args.treeherder_url, offline=args.offline,
+                    repositories_ttl=args.repositories_ttl)
 
     if args.revision_url:
         (args.repo, _, args.revision) = args.revision_url.split('/')[-3:]
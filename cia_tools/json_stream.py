@@ -0,0 +1,140 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Incrementally parse large json files whose top level value is an
+object or an array without loading the whole file into memory.
+"""
+
+import json
+
+CHUNK_SIZE = 1048576
+
+WHITESPACE = ' \t\n\r'
+
+NUMBER_CHARS = '0123456789+-.eE'
+
+
+class JSONStreamReader(object):
+    """Read json values from a text file object chunk_size characters
+    at a time. Only the unparsed remainder of the current chunk is kept
+    in memory.
+
+    If encoding is specified, tell returns offsets in bytes of the
+    encoded file rather than in characters. The file must then be
+    opened with newline='' so that the characters read correspond to
+    the bytes in the file.
+    """
+    def __init__(self, json_file, chunk_size=CHUNK_SIZE, encoding=None):
+        self.json_file = json_file
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.offset = 0
+        self.eof = False
+
+    def length(self, text):
+        """Return the length of text in characters or, if encoding is
+        specified, in encoded bytes."""
+        if self.encoding:
+            return len(text.encode(self.encoding))
+        return len(text)
+
+    def tell(self):
+        """Return the offset in the file of the unparsed remainder of
+        the buffer."""
+        return self.offset + self.length(self.buffer[:self.pos])
+
+    def fill(self, size):
+        """Append up to size characters from the file to the buffer,
+        discarding the parsed part of the buffer. Return False at the
+        end of the file."""
+        chunk = self.json_file.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.offset += self.length(self.buffer[:self.pos])
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming
+        it."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill(self.chunk_size):
+                raise ValueError('Unexpected end of json data')
+
+    def expect(self, chars):
+        """Consume and return the next non-whitespace character which
+        must be one of chars."""
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expected one of %s at %r' % (
+                chars, self.buffer[self.pos:self.pos + 40]))
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """Decode and return the next json value."""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number which is not followed by another character
+                # or is followed by part of a number may continue in
+                # the next chunk.
+                if (self.eof or not isinstance(value, (int, float)) or
+                        (end < len(self.buffer) and self.buffer[end] not in NUMBER_CHARS)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Read larger chunks while the value is incomplete to
+            # avoid decoding a large value many times.
+            self.fill(size)
+            size *= 2
+
+
+    def iter_object_keys(self):
+        """Consume the next json object, yielding each of its keys.
+        The caller must consume the corresponding value, using decode
+        or by iterating over it, before resuming the iteration."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+def iter_object_items(json_file, chunk_size=CHUNK_SIZE):
+    """Yield the (key, value) pairs of the json object in json_file."""
+    reader = JSONStreamReader(json_file, chunk_size)
+    for key in reader.iter_object_keys():
+        yield (key, reader.decode())
+
+
+def iter_array_items(json_file, chunk_size=CHUNK_SIZE):
+    """Yield the items of the json array in json_file."""
+    reader = JSONStreamReader(json_file, chunk_size)
+    reader.expect('[')
+    if reader.peek() == ']':
+        return
+    while True:
+        yield reader.decode()
+        if reader.expect(',]') == ']':
+            return
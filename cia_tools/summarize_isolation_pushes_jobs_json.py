@@ -4,14 +4,20 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import argparse
-import copy
+import collections
+import concurrent.futures
+import csv
 import datetime
+import functools
+import itertools
 import json
 import logging
 import os
 import re
 import sys
 
+import requests
+
 import cache
 import utils
 
@@ -25,6 +31,7 @@ from common_args import (
 
 from treeherder import (
     get_bug_job_map_json,
+    get_bug_job_maps_json,
     get_failure_count_json,
     get_job_bugzilla_suggestions_json,
     get_job_by_repo_job_id_json,
@@ -43,6 +50,54 @@ ORIGINAL_SECTIONS = ('original',)
 ISOLATION_SECTIONS = ('repeated', 'id', 'it')
 TEST_FAILURE_PATTERN = 'TEST-|PROCESS-CRASH|REFTEST TEST-|Assertion failure:'
 
+re_test_failure = re.compile(TEST_FAILURE_PATTERN)
+re_state_completed = re.compile('completed')
+re_result_success_testfailed = re.compile('success|testfailed')
+re_job_type_name_test = re.compile('^test-')
+
+# RevisionQuery is an immutable replacement for a copy of the
+# command line arguments which is used to query Treeherder for the
+# pushes and jobs of a test isolation revision.
+RevisionQuery = collections.namedtuple('RevisionQuery', [
+    'revision_url',
+    'repo',
+    'revision',
+    'date_range',
+    'revision_range',
+    'commit_revision',
+    'author',
+    'push_filters',
+    'job_filters',
+    'add_bugzilla_suggestions',
+    'test_failure_pattern',
+    'update_cache',
+])
+
+
+def get_revision_query(args, revision_url, **job_filters):
+    """Return a RevisionQuery for revision_url which uses the
+    command line push and job filters updated with the compiled
+    job_filters and which includes the bugzilla suggestions for test
+    failures.
+    """
+    (repo, _, revision) = revision_url.split('/')[-3:]
+    query_job_filters = dict(args.job_filters)
+    query_job_filters.update(job_filters)
+    return RevisionQuery(
+        revision_url=revision_url,
+        repo=repo,
+        revision=revision,
+        date_range=args.date_range,
+        revision_range=args.revision_range,
+        commit_revision=args.commit_revision,
+        author=args.author,
+        push_filters=args.push_filters,
+        job_filters=query_job_filters,
+        add_bugzilla_suggestions=True,
+        test_failure_pattern=re_test_failure,
+        update_cache=args.update_cache,
+    )
+
 
 def convert_failure_to_pattern(failure):
     OUTPUT_RE = re.compile(r'\s*(?:GECKO\(\d+\)|PID \d+)\s* [|] ')
@@ -71,246 +126,430 @@ def convert_failure_to_pattern(failure):
     return pattern
 
 
+class BugPatternMatcher(object):
+    """Match failures against the patterns of a list of bugs.
+
+    The distinct patterns are combined into a single regular
+    expression which is used to reject failures which do not match any
+    of the bugs in one pass. Only failures which match the combined
+    expression are checked against the individual patterns. The result
+    for each failure is remembered since the same failures are seen
+    repeatedly across jobs.
+    """
+
+    def __init__(self, patterns):
+        # bug_indexes[i] is the list of indexes of the bugs whose
+        # pattern is unique_patterns[i].
+        unique_patterns = []
+        self.bug_indexes = []
+        pattern_indexes = {}
+        for ibug, pattern in enumerate(patterns):
+            if pattern not in pattern_indexes:
+                pattern_indexes[pattern] = len(unique_patterns)
+                unique_patterns.append(pattern)
+                self.bug_indexes.append([])
+            self.bug_indexes[pattern_indexes[pattern]].append(ibug)
+        self.res = [re.compile(pattern) for pattern in unique_patterns]
+        self.re_any = re.compile('|'.join('(?:%s)' % pattern for pattern in unique_patterns))
+        self.matches = {}
+
+    def match(self, failure):
+        """Return the set of indexes of the bugs whose pattern matches
+        the failure."""
+        if failure in self.matches:
+            return self.matches[failure]
+        matches = set()
+        if self.res and self.re_any.search(failure):
+            for (pattern_re, bug_indexes) in zip(self.res, self.bug_indexes):
+                if pattern_re.search(failure):
+                    matches.update(bug_indexes)
+        self.matches[failure] = matches
+        return matches
+
+
+def get_bugzilla_comments(bug_ids):
+    """Return a dictionary keyed by bug id as a string containing the
+    list of comments for each of the bugs in bug_ids retrieved in a
+    single Bugzilla request.
+
+    """
+    query = BUGZILLA_URL + 'bug/%s/comment' % bug_ids[0]
+    query_terms = {'ids': bug_ids[1:]}
+    response = utils.get_remote_json(query, params=query_terms)
+    if not response or 'error' in response:
+        logger.error('Bugzilla({}, {}): {}'.format(query, query_terms, response))
+        return None
+    return dict((bug_id, bug['comments']) for bug_id, bug in response['bugs'].items())
+
+
 def get_test_isolation_bugzilla_data(args):
     """Query Bugzilla for bugs marked with [test isolation] in the
     whiteboard.  Return a dictionary keyed by revision url containing
     the bug id and summary.
 
+    Each page of bugs is retrieved along with its summaries and its
+    comments in bulk. The Treeherder data for each of the bugs is then
+    retrieved concurrently using up to args.max_workers threads while
+    the next page of bugs is retrieved.
+
+    The data for each bug is cached separately in
+    test-isolation/bugzilla/<bug_id> along with an index in
+    test-isolation/bugzilla-index.json which records the high water
+    mark of the bugs which have been processed. If args.refresh_bugs
+    is specified, only bugs created after the high water mark are
+    retrieved and the failure counts are only retrieved for the cached
+    bugs which have become old enough to have them.
+
+    If a Bugzilla request fails, the bugs which were already retrieved
+    are cached and returned but bugzilla.json is not saved. Bugs whose
+    data could not be retrieved are logged and skipped. They are left
+    out of the index and the high water mark is moved back to the
+    earliest of them so that they are retried by a later run.
+
     """
     cache_attributes = ['test-isolation']
-
+    bug_cache_attributes = ['test-isolation', 'bugzilla']
 
     bugzilla_data = cache.load(cache_attributes, 'bugzilla.json')
-    if bugzilla_data and not args.update_cache:
+    if bugzilla_data and not args.update_cache and not args.refresh_bugs and not args.bugs:
         return json.loads(bugzilla_data)
 
     now = datetime.datetime.now()
 
-    data = {}
+    index_params = {
+        'whiteboard': args.whiteboard,
+        'bug_creation_time': args.bug_creation_time,
+        'bugs_after': args.bugs_after,
+    }
+    index = None
+    if not args.update_cache and not args.bugs:
+        index_data = cache.load(cache_attributes, 'bugzilla-index.json')
+        if index_data:
+            index = json.loads(index_data)
+            if index['params'] != index_params:
+                logger.warning('Ignoring bugzilla-index.json created with {}'.format(
+                    index['params']))
+                index = None
+    if index is None:
+        index = {
+            'params': index_params,
+            'high_water_mark': {'id': 0, 'creation_time': args.bug_creation_time},
+            'bug_ids': [],
+        }
 
-    re_logview = re.compile(r'https://treeherder.mozilla.org/logviewer.html#\?job_id=([0-9]+)&repo=([a-z-]+)')
-    re_pushlog_url = re.compile(r'(https://.*)$\n', re.MULTILINE)
+    # bug_entries[bug_id] = {'bug': bug, 'bug_data': [bug_data, ...]}
+    bug_entries = {}
+    for bug_id in index['bug_ids']:
+        bug_entry_data = cache.load(bug_cache_attributes, bug_id)
+        if bug_entry_data:
+            bug_entries[bug_id] = json.loads(bug_entry_data)
+    if args.bugs and not args.update_cache:
+        for bug_id in args.bugs:
+            bug_entry_data = cache.load(bug_cache_attributes, bug_id)
+            if bug_entry_data:
+                bug_entries[bug_id] = json.loads(bug_entry_data)
+
+    high_water_mark = index['high_water_mark']
 
     query = BUGZILLA_URL + 'bug?'
     query_terms = {
-        'include_fields': 'id,creation_time,whiteboard',
-        'creation_time': args.bug_creation_time,
+        'include_fields': 'id,creation_time,whiteboard,summary',
         'whiteboard': args.whiteboard,
         'limit': 100,
         'offset': 0,
         }
     if args.bugs:
-        query_terms['id'] = ','.join([str(id) for id in args.bugs])
+        query_terms['id'] = ','.join([str(id) for id in args.bugs if id not in bug_entries])
     else:
-        query_terms['creation_time'] = args.bug_creation_time
+        query_terms['creation_time'] = high_water_mark['creation_time']
+
+    complete = True
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        while not args.bugs or query_terms['id']:
+            try:
+                response = utils.get_remote_json(query, params=query_terms)
+            except requests.RequestException as e:
+                logger.error('Bugzilla({}, {}): {}'.format(query, query_terms, e))
+                complete = False
+                break
+            if not response or 'error' in response:
+                logger.error('Bugzilla({}, {}): {}'.format(query, query_terms, response))
+                complete = False
+                break
+
+            if len(response['bugs']) == 0:
+                break
+
+            # update query terms for next iteration of the loop.
+            query_terms['offset'] += query_terms['limit']
+
+            # The high water mark is only advanced once the page's bugs
+            # have been submitted so that a failure does not skip them.
+            page_high_water_mark = dict(high_water_mark)
+            bugs = []
+            for bug in response['bugs']:
+                if bug['id'] in bug_entries:
+                    continue
 
-    while True:
-        response = utils.get_remote_json(query, params=query_terms)
-        if 'error' in response:
-            logger.error('Bugzilla({}, {}): {}'.format(query, query_terms, response))
-            return
+                if not args.bugs:
+                    page_high_water_mark['id'] = max(page_high_water_mark['id'], bug['id'])
+                    page_high_water_mark['creation_time'] = max(
+                        page_high_water_mark['creation_time'], bug['creation_time'])
 
-        if len(response['bugs']) == 0:
-            break
+                if args.bugs_after and bug['id'] <= args.bugs_after:
+                    continue
 
-        # update query terms for next iteration of the loop.
-        query_terms['offset'] += query_terms['limit']
+                if args.whiteboard not in bug['whiteboard']:
+                    # The query performs an all words not substring
+                    # query, so restrict to the substring.
+                    continue
 
-        for bug in response['bugs']:
-            #https://bugzilla.mozilla.org/rest/bug/1559260/comment
+                if args.bugs and bug['id'] not in args.bugs:
+                    continue
 
-            if args.bugs_after and bug['id'] <= args.bugs_after:
+                bugs.append(bug)
+
+            if bugs:
+                try:
+                    comments = get_bugzilla_comments([bug['id'] for bug in bugs])
+                except requests.RequestException as e:
+                    logger.error('Bugzilla comments: {}'.format(e))
+                    comments = None
+                if comments is None:
+                    complete = False
+                    break
+
+                for bug in bugs:
+                    futures.append((bug, executor.submit(
+                        get_test_isolation_bug_data, args, bug, comments[str(bug['id'])], now)))
+
+            high_water_mark.update(page_high_water_mark)
+
+        # Update the failure counts of the previously cached bugs
+        # which have crossed the 15 day window since they were cached.
+        failure_count_futures = []
+        for bug_entry in bug_entries.values():
+            bug = bug_entry['bug']
+            if (bug_entry['bug_data'] and
+                    bug_entry['bug_data'][0]['failure_count'] is None and
+                    is_failure_count_complete(bug, now)):
+                failure_count_futures.append((bug_entry, executor.submit(
+                    get_bug_failure_count, args, bug, now)))
+
+        for (bug_entry, future) in failure_count_futures:
+            try:
+                failure_count = future.result()
+            except Exception:
+                logger.exception('Unable to get failure count for bug {}'.format(
+                    bug_entry['bug']['id']))
+                complete = False
                 continue
-
-            if args.whiteboard not in bug['whiteboard']:
-                # The query performs an all words not substring
-                # query, so restrict to the substring.
+            for bug_data in bug_entry['bug_data']:
+                bug_data['failure_count'] = failure_count
+            cache.save(bug_cache_attributes, bug_entry['bug']['id'],
+                       json.dumps(bug_entry, indent=2))
+
+        failed_bugs = []
+        for (bug, future) in futures:
+            try:
+                bug_data_list = future.result()
+            except Exception:
+                logger.exception('Unable to get data for bug {}'.format(bug['id']))
+                failed_bugs.append(bug)
                 continue
+            bug_entry = {'bug': bug, 'bug_data': bug_data_list}
+            bug_entries[bug['id']] = bug_entry
+            cache.save(bug_cache_attributes, bug['id'], json.dumps(bug_entry, indent=2))
 
-            if args.bugs and bug['id'] not in args.bugs:
-                continue
+    if failed_bugs:
+        complete = False
+        high_water_mark['creation_time'] = min(
+            [high_water_mark['creation_time']] + [bug['creation_time'] for bug in failed_bugs])
 
-            query2 = BUGZILLA_URL + 'bug/%s' % bug['id']
-            response2 = utils.get_remote_json(query2)
-            if 'error' in response2:
-                logger.error('Bugzilla({}): {}'.format(query2, response2))
-                return
+    data = {}
+    for bug_id in sorted(bug_entries):
+        for bug_data in bug_entries[bug_id]['bug_data']:
+            revision_url = bug_data['revision_url']
+            if revision_url not in data:
+                data[revision_url] = []
+            data[revision_url].append(bug_data)
+
+    if not args.bugs:
+        index['bug_ids'] = sorted(bug_entries)
+        cache.save(cache_attributes, 'bugzilla-index.json', json.dumps(index, indent=2))
+        if complete:
+            cache.save(cache_attributes, 'bugzilla.json', json.dumps(data, indent=2))
+        else:
+            logger.warning('Bugzilla data is incomplete, not saving bugzilla.json.')
 
-            bug_summary = response2['bugs'][0]['summary']
-            munged_bug_summary = bugzilla_summary_munge_failure(bug_summary)
+    return data
 
-            query3 = BUGZILLA_URL + 'bug/%s/comment' % bug['id']
-            response3 = utils.get_remote_json(query3)
-            if 'error' in response3:
-                logger.error('Bugzilla({}): {}'.format(query, response3))
-                return
 
-            raw_text = response3['bugs'][str(bug['id'])]['comments'][0]['raw_text']
+def is_failure_count_complete(bug, now):
+    """Return True if the 15 day window used to count the failures for
+    the bug has passed."""
+    start_date = datetime.datetime.strptime(
+        bug['creation_time'].rstrip('Z'), '%Y-%m-%dT%H:%M:%S') - datetime.timedelta(days=1)
+    return now - start_date >= datetime.timedelta(days=15)
 
-            match = re_logview.search(raw_text)
-            if match:
-                # Get push associated with this failed job.
-                job_id = int(match.group(1))
-                repo = match.group(2)
-                job = get_job_by_repo_job_id_json(args, repo, job_id, update_cache=args.update_cache)
-                push_id = job['push_id']
-                push = get_push_json(args, repo, push_id, update_cache=args.update_cache)
-                repository = get_repository_by_id(push['revisions'][0]['repository_id'])
-                revision = push['revisions'][0]['revision']
-                revision_url = '%s/rev/%s' % (repository['url'], revision)
-
-                new_args = copy.deepcopy(args)
-                new_args.revision_url = revision_url
-                (new_args.repo, _, new_args.revision) = new_args.revision_url.split('/')[-3:]
-                new_args.add_bugzilla_suggestions = True
-                new_args.state = 'completed'
-                new_args.result = 'success|testfailed'
-                #new_args.job_type_name = '^test-'
-                new_args.job_type_name = job['job_type_name']
-                new_args.test_failure_pattern = TEST_FAILURE_PATTERN
-                pushes_args.compile_filters(new_args)
-                jobs_args.compile_filters(new_args)
-
-                if revision_url not in data:
-                    data[revision_url] = []
-
-                mozharness_failure = match_bug_summary_to_mozharness_failure(bug_summary, raw_text)
-
-                test = None
-                if mozharness_failure:
-                    test = get_test(mozharness_failure)
-                    pattern = convert_failure_to_pattern(mozharness_failure)
-                if not test:
-                    test = get_test(munged_bug_summary)
-                    pattern = convert_failure_to_pattern(munged_bug_summary)
-                if not test:
-                    logger.warning('Unable to obtain test for '
-                                   'bug {} {} failure {}'.format(
-                                       bug['id'], bug_summary, mozharness_failure))
-
-                bug_data = {
-                    'bug_id': bug['id'],
-                    'bug_summary': bug_summary,
-                    'munged_bug_summary': munged_bug_summary,
-                    'job_type_name': job['job_type_name'],
-                    'test': test,
-                    'mozharness_failure': mozharness_failure,
-                    'job_id': job_id,
-                    'push_id': push_id,
-                    'repository': repository['name'],
-                    'revision_url': revision_url,
-                    'bugzilla_suggestions': get_job_bugzilla_suggestions_json(new_args, new_args.repo, job_id, update_cache=args.update_cache),
-                    'bug_job_map': get_bug_job_map_json(new_args, new_args.repo, job_id, update_cache=args.update_cache),
-                    'pattern': pattern,
-                }
-
-                data[revision_url].append(bug_data)
-
-                # Get failure counts for trunk for this bug for the two weeks following
-                # the creation of the bug. Ignore failure counts for bugs who are less
-                # than 2 weeks old.
-                # TODO: Allow in place updating of bugzilla.json so that we can reprocess
-                # the failure counts without having to query the full set of bugs.
-                start_date = datetime.datetime.strptime(
-                    bug['creation_time'].rstrip('Z'), '%Y-%m-%dT%H:%M:%S') - datetime.timedelta(days=1)
-                end_date = start_date + datetime.timedelta(days=15)
-                failure_count_json = get_failure_count_json(args, 'trunk', bug['id'], start_date, end_date)
-                if now - start_date < datetime.timedelta(days=15):
-                    failure_count = None
-                else:
-                    failure_count = 0
-                    for failures in failure_count_json:
-                        failure_count += failures['failure_count']
-                bug_data['failure_count'] = failure_count
 
-            elif args.whiteboard and False: #Disable this as it is buggy.
-                # This run has specified the test or is this is a bug
-                # that is not a Treeherder filed bug. If it was marked
-                # via the whiteboad then we are interested in the
-                # pushes for this bug.  Since we can't really tell
-                # which is which, we can include all of the pushes
-                # since only those with test isolation jobs will
-                # matter.  The problem is this bug does not
-                # necessarily have a bug_summary referencing a test
-                # failure...
-                test = None # We don't have a failure in this case.
-                comments = response3['bugs'][str(bug['id'])]['comments']
-                for comment in comments:
-                    if not comment['raw_text'].startswith('Pushed by'):
-                        continue
-                    # Get the last revision in the comment as the head of the push.
-                    revision_url = None
-                    pushlog_url_match = re_pushlog_url.search(comment['raw_text'])
-                    while pushlog_url_match:
-                        revision_url = pushlog_url_match.group(1)
-                        pushlog_url_match = re_pushlog_url.search(comment['raw_text'], pushlog_url_match.end(1))
-                    if revision_url:
-                        # revision_url from Bugzilla has the 12 character revision.
-                        new_args = copy.deepcopy(args)
-                        new_args.revision_url = revision_url
-                        (new_args.repo, _, new_args.revision) = new_args.revision_url.split('/')[-3:]
-                        new_args.add_bugzilla_suggestions = True
-                        new_args.state = 'completed'
-                        new_args.job_type_name = '^test-'
-                        new_args.test_failure_pattern = TEST_FAILURE_PATTERN
-                        pushes_args.compile_filters(new_args)
-                        jobs_args.compile_filters(new_args)
-
-                        pushes = get_pushes_jobs_json(new_args, new_args.repo, update_cache=args.update_cache)
-                        if len(pushes):
-                            # Convert the revision url to 40 characters.
-                            push = pushes[0]
-                            repository = get_repository_by_id(push['revisions'][0]['repository_id'])
-                            revision = push['revisions'][0]['revision']
-                            revision_url = '%s/rev/%s' % (repository['url'], revision)
-                            new_args.revision_url = revision_url
-                            (new_args.repo, _, new_args.revision) = new_args.revision_url.split('/')[-3:]
-
-                            if revision_url not in data:
-                                data[revision_url] = []
-
-                            push_id = push['id']
-                            repository = get_repository_by_id(push['revisions'][0]['repository_id'])
-                            # Only the original job is of interest for collecting the bugzilla data.
-                            # The others are the retriggers.
-                            #  There shouldn't be a bug_job_map or bugzilla_suggestions for non-classified bugs.
-                            job_id = push['jobs'][0]
-
-                            bug_data = {
-                                'bug_id': bug['id'],
-                                'bug_summary': bug_summary,
-                                'test': test,
-                                'job_id': job_id,
-                                'push_id': push_id,
-                                'repository': repository['name'],
-                                'revision_url': revision_url,
-                                'bugzilla_suggestions': [],
-                                'bug_job_map': [],
-                                'pattern': convert_failure_to_pattern(bug_summary),
-                            }
-                            data[revision_url].append(bug_data)
-
-                            # Get failure counts for trunk for this bug for the two weeks following
-                            # the creation of the bug. Ignore failure counts for bugs who are less
-                            # than 2 weeks old. Use the previous day for the start date and 15 days
-                            # to account for timezone issues.
-                            # TODO: Allow in place updating of bugzilla.json so that we can reprocess
-                            # the failure counts without having to query the full set of bugs.
-                            start_date = datetime.datetime.strptime(
-                                bug['creation_time'].rstrip('Z'), '%Y-%m-%dT%H:%M:%S') - datetime.timedelta(days=1)
-                            end_date = start_date + datetime.timedelta(days=15)
-                            failure_count_json = get_failure_count_json(args, 'trunk', bug['id'], start_date, end_date)
-                            if now - start_date < datetime.timedelta(days=15):
-                                failure_count = None
-                            else:
-                                failure_count = 0
-                                for failures in failure_count_json:
-                                    failure_count += failures['failure_count']
-                            bug_data['failure_count'] = failure_count
-
-    cache.save(cache_attributes, 'bugzilla.json', json.dumps(data, indent=2))
+def get_bug_failure_count(args, bug, now):
+    """Get failure counts for trunk for this bug for the two weeks
+    following the creation of the bug. Ignore failure counts for bugs
+    who are less than 2 weeks old. Use the previous day for the start
+    date and 15 days to account for timezone issues. Return None if the
+    failure counts could not be retrieved so that they are retried later.
+
+    """
+    if not is_failure_count_complete(bug, now):
+        return None
+    start_date = datetime.datetime.strptime(
+        bug['creation_time'].rstrip('Z'), '%Y-%m-%dT%H:%M:%S') - datetime.timedelta(days=1)
+    end_date = start_date + datetime.timedelta(days=15)
+    failure_count_json = get_failure_count_json(args, 'trunk', bug['id'], start_date, end_date)
+    if failure_count_json is None:
+        logger.warning('Unable to get failure count for bug {}'.format(bug['id']))
+        return None
+    failure_count = 0
+    for failures in failure_count_json:
+        failure_count += failures['failure_count']
+    return failure_count
 
-    return data
+
+def get_test_isolation_bug_data(args, bug, comments, now):
+    """Return a list of the bug data objects for the bug with the
+    specified comments. bug contains the id, creation_time, whiteboard
+    and summary fields returned from Bugzilla.
+
+    """
+    re_logview = re.compile(r'https://treeherder.mozilla.org/logviewer.html#\?job_id=([0-9]+)&repo=([a-z-]+)')
+    re_pushlog_url = re.compile(r'(https://.*)$\n', re.MULTILINE)
+
+    bug_data_list = []
+
+    bug_summary = bug['summary']
+    munged_bug_summary = bugzilla_summary_munge_failure(bug_summary)
+
+    raw_text = comments[0]['raw_text']
+
+    match = re_logview.search(raw_text)
+    if match:
+        # Get push associated with this failed job.
+        job_id = int(match.group(1))
+        repo = match.group(2)
+        job = get_job_by_repo_job_id_json(args, repo, job_id, update_cache=args.update_cache)
+        if job is None:
+            raise ValueError('Unable to retrieve job {} for {}'.format(job_id, repo))
+        push_id = job['push_id']
+        push = get_push_json(args, repo, push_id, update_cache=args.update_cache)
+        if push is None:
+            raise ValueError('Unable to retrieve push {} for {}'.format(push_id, repo))
+        repository = get_repository_by_id(push['revisions'][0]['repository_id'])
+        revision = push['revisions'][0]['revision']
+        revision_url = '%s/rev/%s' % (repository['url'], revision)
+
+        new_args = get_revision_query(
+            args, revision_url,
+            state=re_state_completed,
+            result=re_result_success_testfailed,
+            job_type_name=re.compile(job['job_type_name']))
+
+        mozharness_failure = match_bug_summary_to_mozharness_failure(bug_summary, raw_text)
+
+        test = None
+        if mozharness_failure:
+            test = get_test(mozharness_failure)
+            pattern = convert_failure_to_pattern(mozharness_failure)
+        if not test:
+            test = get_test(munged_bug_summary)
+            pattern = convert_failure_to_pattern(munged_bug_summary)
+        if not test:
+            logger.warning('Unable to obtain test for '
+                           'bug {} {} failure {}'.format(
+                               bug['id'], bug_summary, mozharness_failure))
+
+        bug_data = {
+            'bug_id': bug['id'],
+            'bug_summary': bug_summary,
+            'munged_bug_summary': munged_bug_summary,
+            'job_type_name': job['job_type_name'],
+            'test': test,
+            'mozharness_failure': mozharness_failure,
+            'job_id': job_id,
+            'push_id': push_id,
+            'repository': repository['name'],
+            'revision_url': revision_url,
+            'bugzilla_suggestions': get_job_bugzilla_suggestions_json(new_args, new_args.repo, job_id, update_cache=args.update_cache),
+            'bug_job_map': get_bug_job_map_json(new_args, new_args.repo, job_id, update_cache=args.update_cache),
+            'pattern': pattern,
+        }
+
+        bug_data_list.append(bug_data)
+
+        bug_data['failure_count'] = get_bug_failure_count(args, bug, now)
+
+    elif args.whiteboard and False: #Disable this as it is buggy.
+        # This run has specified the test or is this is a bug
+        # that is not a Treeherder filed bug. If it was marked
+        # via the whiteboad then we are interested in the
+        # pushes for this bug.  Since we can't really tell
+        # which is which, we can include all of the pushes
+        # since only those with test isolation jobs will
+        # matter.  The problem is this bug does not
+        # necessarily have a bug_summary referencing a test
+        # failure...
+        test = None # We don't have a failure in this case.
+        for comment in comments:
+            if not comment['raw_text'].startswith('Pushed by'):
+                continue
+            # Get the last revision in the comment as the head of the push.
+            revision_url = None
+            pushlog_url_match = re_pushlog_url.search(comment['raw_text'])
+            while pushlog_url_match:
+                revision_url = pushlog_url_match.group(1)
+                pushlog_url_match = re_pushlog_url.search(comment['raw_text'], pushlog_url_match.end(1))
+            if revision_url:
+                # revision_url from Bugzilla has the 12 character revision.
+                new_args = get_revision_query(
+                    args, revision_url,
+                    state=re_state_completed,
+                    job_type_name=re_job_type_name_test)
+
+                pushes = get_pushes_jobs_json(new_args, new_args.repo, update_cache=args.update_cache)
+                if len(pushes):
+                    # Convert the revision url to 40 characters.
+                    push = pushes[0]
+                    repository = get_repository_by_id(push['revisions'][0]['repository_id'])
+                    revision = push['revisions'][0]['revision']
+                    revision_url = '%s/rev/%s' % (repository['url'], revision)
+                    (repo, _, revision) = revision_url.split('/')[-3:]
+                    new_args = new_args._replace(revision_url=revision_url, repo=repo, revision=revision)
+
+                    push_id = push['id']
+                    repository = get_repository_by_id(push['revisions'][0]['repository_id'])
+                    # Only the original job is of interest for collecting the bugzilla data.
+                    # The others are the retriggers.
+                    #  There shouldn't be a bug_job_map or bugzilla_suggestions for non-classified bugs.
+                    job_id = push['jobs'][0]
+
+                    bug_data = {
+                        'bug_id': bug['id'],
+                        'bug_summary': bug_summary,
+                        'test': test,
+                        'job_id': job_id,
+                        'push_id': push_id,
+                        'repository': repository['name'],
+                        'revision_url': revision_url,
+                        'bugzilla_suggestions': [],
+                        'bug_job_map': [],
+                        'pattern': convert_failure_to_pattern(bug_summary),
+                    }
+                    bug_data_list.append(bug_data)
+
+                    bug_data['failure_count'] = get_bug_failure_count(args, bug, now)
+
+    return bug_data_list
 
 
 # Patterns used to remove or replace text in the bug summary.
@@ -379,10 +618,19 @@ def munge_test_path(test_path):
     return test_path
 
 
+re_output = re.compile(r'\s*(?:GECKO\(\d+\)|PID \d+)\s*$')
+re_appcrashed = re.compile(r'application crash .*')
+
+
+@functools.lru_cache(maxsize=65536)
 def get_test(failure):
-    OUTPUT_RE = re.compile(r'\s*(?:GECKO\(\d+\)|PID \d+)\s*$')
+    """Return the test extracted from the failure or None.
+
+    The results are memoized since the same failures occur repeatedly
+    across jobs.
+    """
     parts = failure.split(' | ')
-    if OUTPUT_RE.match(parts[0]):
+    if re_output.match(parts[0]):
         parts.pop(0)
 
     if len(parts) >= 3:
@@ -412,56 +660,227 @@ def get_test(failure):
         if not test:
             test = None
         else:
-            re_appcrashed = re.compile(r'application crash .*')
             match = re_appcrashed.search(test)
             if match:
                 test = test.replace(match.group(0), '')
     return test
 
 
+def get_tests(failures):
+    """Return a dict mapping each of the failures to its test."""
+    return dict((failure, get_test(failure)) for failure in set(failures))
+
+
+SECTION_NAMES = ORIGINAL_SECTIONS + ISOLATION_SECTIONS
+SECTION_INDEXES = dict((section_name, isection)
+                       for (isection, section_name) in enumerate(SECTION_NAMES))
+
+
+class SectionSummary(object):
+    """Statistics for the jobs in one section of a job type.
+
+    failures and tests count the occurrences of each failure and test
+    while failures_reproduced and tests_reproduced count how often they
+    reproduced a bug. Use to_json to convert to the output format.
+    """
+    __slots__ = ('failures', 'failures_reproduced', 'tests', 'tests_reproduced',
+                 'failure_reproduced', 'test_reproduced', 'bug_job_map',
+                 'run_time', 'jobs_testfailed', 'jobs_total',
+                 'bugzilla_suggestions_count')
+
+    def __init__(self):
+        self.failures = collections.Counter()
+        self.failures_reproduced = collections.Counter()
+        self.tests = collections.Counter()
+        self.tests_reproduced = collections.Counter()
+        self.failure_reproduced = 0
+        self.test_reproduced = 0
+        self.bug_job_map = None
+        self.run_time = 0
+        self.jobs_testfailed = 0
+        self.jobs_total = 0
+        self.bugzilla_suggestions_count = 0
+
+    def to_json(self):
+        section = dict(
+            failures = dict(
+                (failure, dict(count = count,
+                               failure_reproduced = self.failures_reproduced[failure]))
+                for (failure, count) in self.failures.items()),
+            tests = dict(
+                (test, dict(count = count,
+                            test_reproduced = self.tests_reproduced[test]))
+                for (test, count) in self.tests.items()),
+            failure_reproduced = self.failure_reproduced,
+            test_reproduced = self.test_reproduced,
+        )
+        if self.bug_job_map is not None:
+            section['bug_job_map'] = self.bug_job_map
+        section['run_time'] = self.run_time
+        section['jobs_testfailed'] = self.jobs_testfailed
+        section['jobs_total'] = self.jobs_total
+        section['bugzilla_suggestions_count'] = self.bugzilla_suggestions_count
+        return section
+
+
+class JobTypeSummary(object):
+    """Summary of the test isolation jobs of a job type.
+
+    bugzilla_data is the list of bug data for the revision which is
+    shared read only with the other job types. failure_reproduced and
+    test_reproduced are lists indexed by bug containing lists indexed
+    by section of the number of times the bug's failure or test was
+    seen. sections is the list of SectionSummary indexed by section.
+    Use to_json to convert to the output format.
+    """
+    __slots__ = ('isolation_job', 'bugzilla_data', 'failure_reproduced',
+                 'test_reproduced', 'sections')
+
+    def __init__(self, isolation_job, bugzilla_data):
+        self.isolation_job = isolation_job
+        self.bugzilla_data = bugzilla_data
+        self.failure_reproduced = [[0] * len(SECTION_NAMES) for bug_data in bugzilla_data]
+        self.test_reproduced = [[0] * len(SECTION_NAMES) for bug_data in bugzilla_data]
+        self.sections = [SectionSummary() for section_name in SECTION_NAMES]
+
+    def to_json(self):
+        job_type = dict(
+            notes = [],
+            isolation_job = self.isolation_job,
+            bugzilla_data = [
+                dict(bug_data,
+                     failure_reproduced = dict(zip(SECTION_NAMES, failure_reproduced)),
+                     test_reproduced = dict(zip(SECTION_NAMES, test_reproduced)))
+                for (bug_data, failure_reproduced, test_reproduced) in zip(
+                    self.bugzilla_data, self.failure_reproduced, self.test_reproduced)],
+        )
+        for (section_name, section) in zip(SECTION_NAMES, self.sections):
+            job_type[section_name] = section.to_json()
+        return job_type
+
+
+def summary_to_json(summary):
+    """Convert the summary of JobTypeSummary objects into the json
+    output format."""
+    return dict(
+        (revision_url, dict(
+            (job_type_name, job_type_summary.to_json())
+            for (job_type_name, job_type_summary) in summary[revision_url].items()))
+        for revision_url in summary)
+
+
 def summarize_isolation_pushes_jobs_json(args):
+    """Return the test isolation summary for the revisions of the test
+    isolation bugs.
 
-    pushes = []
+    If args.processes is greater than 1, each revision is fetched and
+    summarized in its own worker process and the per-revision
+    summaries are merged.
+    """
+    summary = {}
 
     test_isolation_bugzilla_data = get_test_isolation_bugzilla_data(args)
-    for revision_url in test_isolation_bugzilla_data:
-        revision_data = test_isolation_bugzilla_data[revision_url]
-        new_args = copy.deepcopy(args)
-        new_args.revision_url = revision_url
-        (new_args.repo, _, new_args.revision) = new_args.revision_url.split('/')[-3:]
-        new_args.add_bugzilla_suggestions = True
-        new_args.state = 'completed'
-        new_args.result = 'success|testfailed'
-        new_args.job_type_name = '^test-'
-        new_args.test_failure_pattern = TEST_FAILURE_PATTERN
-        jobs_args.compile_filters(new_args)
-
-        # Load the pushes/jobs data from cache if it exists.
-        cache_attributes = ['test-isolation', new_args.repo]
-        pushes_jobs_data = cache.load(cache_attributes, new_args.revision)
-        if pushes_jobs_data and not args.update_cache:
-            new_pushes = json.loads(pushes_jobs_data)
-        else:
-            new_pushes = get_pushes_jobs_json(new_args, new_args.repo, update_cache=args.update_cache)
-            cache.save(cache_attributes, new_args.revision, json.dumps(new_pushes, indent=2))
+    revision_urls = list(test_isolation_bugzilla_data.keys())
+    revisions_data = [test_isolation_bugzilla_data[revision_url] for revision_url in revision_urls]
+
+    if args.processes > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.processes,
+                initializer=init_summarize_worker,
+                initargs=(args,)) as executor:
+            revision_summaries = list(executor.map(
+                summarize_revision, itertools.repeat(args), revision_urls, revisions_data))
+    else:
+        revision_summaries = map(
+            summarize_revision, itertools.repeat(args), revision_urls, revisions_data)
 
-        pushes.extend(new_pushes)
+    for revision_summary in revision_summaries:
+        for revision_url in revision_summary:
+            if revision_url not in summary:
+                summary[revision_url] = {}
+            summary[revision_url].update(revision_summary[revision_url])
+
+    return summary
 
-        for revision_bug_data in revision_data:
-            if args.bugs and revision_bug_data['bug_id'] not in args.bugs:
-                # Skip if we requested a specific bug and this is not it.
-                continue
-            if args.bugs and args.override_bug_summary:
-                revision_bug_data['bug_summary'] = bugzilla_summary_munge_failure(args.override_bug_summary)
 
+def init_summarize_worker(args):
+    """Initialize the module state of a summarize_revision worker
+    process which is not inherited when processes are spawned. Each
+    worker is limited to its share of the request rate to each host."""
+    global logger
+
+    logging.basicConfig(level=getattr(logging, args.log_level))
+    logger = logging.getLogger()
+    cache.CACHE_HOME = args.cache
+    utils.share_host_rate(args.processes)
+    init_treeherder(args.treeherder_url, offline=args.offline,
+                    repositories_ttl=args.repositories_ttl)
+
+
+def summarize_revision(args, revision_url, revision_data):
+    """Fetch the pushes and jobs for the revision and return the
+    summary of its test isolation jobs for the bugs in revision_data.
+    """
+    new_args = get_revision_query(
+        args, revision_url,
+        state=re_state_completed,
+        result=re_result_success_testfailed,
+        job_type_name=re_job_type_name_test)
+
+    # Load the pushes/jobs data from cache if it exists.
+    cache_attributes = ['test-isolation', new_args.repo]
+    pushes_jobs_data = cache.load(cache_attributes, new_args.revision)
+    if pushes_jobs_data and not args.update_cache:
+        pushes = json.loads(pushes_jobs_data)
+    else:
+        pushes = get_pushes_jobs_json(new_args, new_args.repo, update_cache=args.update_cache)
+        cache.save(cache_attributes, new_args.revision, json.dumps(pushes, indent=2))
     pushes_jobs_data = None
+
+    for revision_bug_data in revision_data:
+        if args.bugs and revision_bug_data['bug_id'] not in args.bugs:
+            # Skip if we requested a specific bug and this is not it.
+            continue
+        if args.bugs and args.override_bug_summary:
+            revision_bug_data['bug_summary'] = bugzilla_summary_munge_failure(args.override_bug_summary)
+
     data = convert_pushes_to_test_isolation_bugzilla_data(args, pushes)
 
     #logger.info('convert_pushes_to_test_isolation_bugzilla_data\n{}'.format(
     #    json.dumps(data, indent=2)))
 
+    return summarize_test_isolation_data(args, data, {revision_url: revision_data})
+
+
+def summarize_test_isolation_data(args, data, test_isolation_bugzilla_data):
+    """Return the summary of the test isolation jobs in data, as
+    returned by convert_pushes_to_test_isolation_bugzilla_data, for
+    the bugs in test_isolation_bugzilla_data. The summary is a dict
+    keyed by revision url of dicts keyed by job type name of
+    JobTypeSummary objects.
+    """
     summary = {}
 
+    # Match the failures against all of the bug patterns for a revision
+    # at once and determine the bug tests once per bug.
+    # bug_matchers[revision_url] is a BugPatternMatcher and
+    # bug_tests[revision_url] the list of tests for the bugs in
+    # test_isolation_bugzilla_data[revision_url].
+    bug_matchers = {}
+    bug_tests = {}
+    for revision_url in data:
+        revision_bugzilla_data = test_isolation_bugzilla_data[revision_url]
+        if args.bugs and args.override_bug_summary:
+            pattern = convert_failure_to_pattern(args.override_bug_summary)
+            test = get_test(args.override_bug_summary)
+            bug_matchers[revision_url] = BugPatternMatcher(
+                [pattern for bug_data in revision_bugzilla_data])
+            bug_tests[revision_url] = [test for bug_data in revision_bugzilla_data]
+        else:
+            bug_matchers[revision_url] = BugPatternMatcher(
+                [bug_data['pattern'] for bug_data in revision_bugzilla_data])
+            bug_tests[revision_url] = [bug_data['test'] for bug_data in revision_bugzilla_data]
+
     for revision_url in data:
 
         (repo, _, revision) = revision_url.split('/')[-3:]
@@ -474,59 +893,35 @@ def summarize_isolation_pushes_jobs_json(args):
 
         for job_type_name in job_type_names:
             if job_type_name not in summary_revision:
-                summary_revision[job_type_name] = dict(
-                    notes = [],
-                    isolation_job = "{}/#/jobs?repo={}&tier=1%2C2%2C3&revision={}&searchStr={}".format(
+                summary_revision[job_type_name] = JobTypeSummary(
+                    "{}/#/jobs?repo={}&tier=1%2C2%2C3&revision={}&searchStr={}".format(
                         args.treeherder_url, repo, revision, job_type_name),
-                )
+                    test_isolation_bugzilla_data[revision_url])
             summary_revision_job_type = summary_revision[job_type_name]
+            bug_failure_reproduced = summary_revision_job_type.failure_reproduced
+            bug_test_reproduced = summary_revision_job_type.test_reproduced
 
             job_type = data[revision_url][job_type_name]
 
-            if 'bugzilla_data' not in summary_revision_job_type:
-                summary_revision_job_type['bugzilla_data'] = copy.deepcopy(test_isolation_bugzilla_data[revision_url])
-                for bug_data in summary_revision_job_type['bugzilla_data']:
-                    # bug_data['failure_reproduced'][section_name] counts the
-                    # number of times the original bug_summary failure
-                    # was seen in that section of jobs.
-                    bug_data['failure_reproduced'] = dict(
-                        original = 0,
-                        repeated = 0,
-                        id = 0,
-                        it = 0,
-                    )
-                    # bug_data['test_reproduced'][section_name] counts the
-                    # number of times the original bug_summary test
-                    # was seen in that section of jobs.
-                    bug_data['test_reproduced'] = dict(
-                        original = 0,
-                        repeated = 0,
-                        id = 0,
-                        it = 0,
-                    )
-
-            for section_name in (ORIGINAL_SECTIONS + ISOLATION_SECTIONS):
-                if section_name not in summary_revision_job_type:
-                    summary_revision_job_type[section_name] = dict(
-                        failures = {},
-                        tests = {},
-                        failure_reproduced = 0,
-                        test_reproduced = 0,
-                    )
-                    if section_name == 'original':
-                        summary_revision_job_type[section_name]['bug_job_map'] = []
-
-                summary_revision_job_type_section = summary_revision_job_type[section_name]
+            for (isection, section_name) in enumerate(SECTION_NAMES):
+                summary_revision_job_type_section = summary_revision_job_type.sections[isection]
+                if section_name == 'original' and summary_revision_job_type_section.bug_job_map is None:
+                    summary_revision_job_type_section.bug_job_map = []
 
                 job_type_section = job_type[section_name]
 
+                failures = summary_revision_job_type_section.failures
+                failures_reproduced = summary_revision_job_type_section.failures_reproduced
+                tests = summary_revision_job_type_section.tests
+                tests_reproduced = summary_revision_job_type_section.tests_reproduced
+
                 run_time = 0
                 jobs_testfailed_count = 0
                 bugzilla_suggestions_count = 0
 
                 for job in job_type_section:
                     if section_name == 'original':
-                        summary_revision_job_type_section['bug_job_map'].extend(job['bug_job_map'])
+                        summary_revision_job_type_section.bug_job_map.extend(job['bug_job_map'])
                     run_time += job['end_timestamp'] - job['start_timestamp']
                     jobs_testfailed_count += 1 if job['result'] == 'testfailed' else 0
                     bugzilla_suggestions_count += len(job['bugzilla_suggestions'])
@@ -535,46 +930,29 @@ def summarize_isolation_pushes_jobs_json(args):
 
                         #failure = bugzilla_summary_munge_failure(bugzilla_suggestion['search'])
                         failure = bugzilla_suggestion['search']
-                        if failure not in summary_revision_job_type_section['failures']:
-                            summary_revision_job_type_section['failures'][failure] = dict(
-                                count = 0,
-                                failure_reproduced = 0,
-                            )
-
-                        summary_revision_job_type_section['failures'][failure]['count'] += 1
-                        for bug_data in summary_revision_job_type['bugzilla_data']:
-                            if args.bugs and args.override_bug_summary:
-                                #pattern = convert_failure_to_pattern(bugzilla_summary_munge_failure(args.override_bug_summary))
-                                pattern = convert_failure_to_pattern(args.override_bug_summary)
-                            else:
-                                pattern = bug_data['pattern']
-                            if re.compile(pattern).search(failure):
-                                bug_data['failure_reproduced'][section_name] += 1
-                                summary_revision_job_type_section['failures'][failure]['failure_reproduced'] += 1
-                                summary_revision_job_type_section['failure_reproduced'] += 1
-
-                            test = get_test(failure)
-                            if test:
-                                if test not in summary_revision_job_type_section['tests']:
-                                    summary_revision_job_type_section['tests'][test] = dict(
-                                        count = 0,
-                                        test_reproduced = 0,
-                                    )
-
-                                summary_revision_job_type_section['tests'][test]['count'] += 1
-                                if args.bugs and args.override_bug_summary:
-                                    bug_data_test = get_test(args.override_bug_summary)
-                                else:
-                                    bug_data_test = bug_data['test']
+                        failures[failure] += 1
+
+                        bug_matches = bug_matchers[revision_url].match(failure)
+                        if bug_matches:
+                            for ibug in bug_matches:
+                                bug_failure_reproduced[ibug][isection] += 1
+                            failures_reproduced[failure] += len(bug_matches)
+                            summary_revision_job_type_section.failure_reproduced += len(bug_matches)
+
+                        test = get_test(failure)
+                        if test and bug_tests[revision_url]:
+                            # Each bug counts the test once.
+                            tests[test] += len(bug_tests[revision_url])
+                            for (ibug, bug_data_test) in enumerate(bug_tests[revision_url]):
                                 if bug_data_test and test in bug_data_test:
-                                    bug_data['test_reproduced'][section_name] += 1
-                                    summary_revision_job_type_section['tests'][test]['test_reproduced'] += 1
-                                    summary_revision_job_type_section['test_reproduced'] += 1
+                                    bug_test_reproduced[ibug][isection] += 1
+                                    tests_reproduced[test] += 1
+                                    summary_revision_job_type_section.test_reproduced += 1
 
-                summary_revision_job_type_section['run_time'] = run_time
-                summary_revision_job_type_section['jobs_testfailed'] = jobs_testfailed_count
-                summary_revision_job_type_section['jobs_total'] = len(job_type_section)
-                summary_revision_job_type_section['bugzilla_suggestions_count'] = bugzilla_suggestions_count
+                summary_revision_job_type_section.run_time = run_time
+                summary_revision_job_type_section.jobs_testfailed = jobs_testfailed_count
+                summary_revision_job_type_section.jobs_total = len(job_type_section)
+                summary_revision_job_type_section.bugzilla_suggestions_count = bugzilla_suggestions_count
 
     return summary
 
@@ -645,6 +1023,7 @@ def convert_pushes_to_test_isolation_bugzilla_data(args, pushes):
                     }
 
         # Collect the test isolation jobs
+        original_jobs = []
         for job in push['jobs']:
             job_type_name = job['job_type_name']
             if job_type_name not in revision_data:
@@ -656,9 +1035,7 @@ def convert_pushes_to_test_isolation_bugzilla_data(args, pushes):
             isolation_group = is_isolation_job_group_symbol(job_group_symbol)
             if isolation_type is None and isolation_group is None:
                 data_job_type['original'].append(job)
-                # Add the bug_job_map object to the original job
-                # in order to track which bug was "isolated".
-                job['bug_job_map'] = get_bug_job_map_json(args, repository['name'], job['id'], update_cache=args.update_cache)
+                original_jobs.append(job)
             elif isolation_type == 'id':
                 data_job_type['id'].append(job)
             elif isolation_type == 'it':
@@ -668,111 +1045,105 @@ def convert_pushes_to_test_isolation_bugzilla_data(args, pushes):
             else:
                 pass
 
-    return data
-
-
-def output_csv_summary(args, summary):
-    """Output a csv file summarizing the test isolation results.
+        # Add the bug_job_map object to the original jobs in order
+        # to track which bug was "isolated".
+        bug_job_maps = get_bug_job_maps_json(
+            args, repository['name'], [job['id'] for job in original_jobs],
+            update_cache=args.update_cache)
+        for job in original_jobs:
+            job['bug_job_map'] = bug_job_maps[job['id']]
 
-    Note that a semi-colon (;) is used to delimit fields instead of a
-    comma (,) due to the embedded commas in the bug summaries. Also
-    double quotes are not used to delimit text fields since the data
-    contains embedded quotes in the bug summaries.
+    return data
 
-    """
-    line = ('job;revision;job type_name;bug;bugmap;summary;failure;test;'
-            'has failure;has test;has bugzilla suggestions;failure count;')
 
-    for section_name in (ORIGINAL_SECTIONS + ISOLATION_SECTIONS):
+def generate_csv_summary_rows(summary):
+    """Generate the header and the rows of the csv summary of the test
+    isolation results one at a time."""
+    header = ['job', 'revision', 'job type_name', 'bug', 'bugmap', 'summary',
+              'failure', 'test', 'has failure', 'has test',
+              'has bugzilla suggestions', 'failure count']
 
-        line += ('{section_name} run time;'
-                 '{section_name} jobs total;'
-                 '{section_name} jobs testfailed;'
-                 '{section_name} jobs testfailed per job;'
-                 '{section_name}_failures reproduced;'
-                 '{section_name} failures reproduced per job;'
-                 '{section_name}_tests reproduced;'
-                 '{section_name} tests reproduced per job;'.format(section_name=section_name))
+    for section_name in SECTION_NAMES:
+        header.extend([
+            '{} run time'.format(section_name),
+            '{} jobs total'.format(section_name),
+            '{} jobs testfailed'.format(section_name),
+            '{} jobs testfailed per job'.format(section_name),
+            '{}_failures reproduced'.format(section_name),
+            '{} failures reproduced per job'.format(section_name),
+            '{}_tests reproduced'.format(section_name),
+            '{} tests reproduced per job'.format(section_name),
+        ])
 
-    line = line[0:-1]
-    print(line)
+    yield header
 
     for revision_url in summary:
         summary_revision = summary[revision_url]
         for job_type_name in summary_revision:
             summary_revision_job_type = summary_revision[job_type_name]
-            job_url = summary_revision_job_type['isolation_job']
-            for bug_data in summary_revision_job_type['bugzilla_data']:
+            job_url = summary_revision_job_type.isolation_job
+            bug_job_map = summary_revision_job_type.sections[SECTION_INDEXES['original']].bug_job_map
+            bugs = ','.join(sorted(set([ str(job_bug['bug_id']) for job_bug in bug_job_map ])))
+            for (ibug, bug_data) in enumerate(summary_revision_job_type.bugzilla_data):
                 if bug_data['job_type_name'] != job_type_name:
                     # XXX: Change the data structure so we don't have mixups like this.
                     continue
-                bug_id = bug_data['bug_id']
-                bug_summary = bug_data['bug_summary'].replace(';', ' ')
                 failure = bug_data['mozharness_failure']
-                if failure is not None:
-                    failure = failure.replace(';', ' ')
-                    has_failure = True
-                else:
-                    has_failure = False
-
                 test = bug_data['test']
-                if test is not None:
-                    test = test.replace(';', ' ')
-                    has_test = True
-                else:
-                    has_test = False
-                bugzilla_suggestions = (len(bug_data['bugzilla_suggestions']) > 0)
-                failure_count = bug_data['failure_count']
-                bug_job_map = summary_revision_job_type['original']['bug_job_map']
-                bugs = ','.join(sorted(set([ str(job_bug['bug_id']) for job_bug in bug_job_map ])))
                 #if bugs and str(bug_id) not in bugs:
                 #    # Ignore other bugs filed for this revision if they are not in the
                 #    # current job bug map but only if there are other bugs filed.
                 #    continue
 
-                line =  '{};'.format(job_url)
-                line += '{};'.format(revision_url)
-                line += '{};'.format(job_type_name)
-                line += '{};'.format(bug_id)
-                line += '{};'.format(bugs)
-                line += '{};'.format(bug_summary)
-                line += '{};'.format(failure)
-                line += '{};'.format(test)
-                line += '{};'.format(has_failure)
-                line += '{};'.format(has_test)
-                line += '{};'.format(bugzilla_suggestions)
-                line += '{};'.format(failure_count)
-
-                for section_name in (ORIGINAL_SECTIONS + ISOLATION_SECTIONS):
-                    summary_revision_job_type_section = summary_revision_job_type[section_name]
-
-                    run_time = summary_revision_job_type_section['run_time']
-
-                    jobs_total = summary_revision_job_type_section['jobs_total']
-                    jobs_testfailed = summary_revision_job_type_section['jobs_testfailed']
+                row = [
+                    job_url,
+                    revision_url,
+                    job_type_name,
+                    bug_data['bug_id'],
+                    bugs,
+                    bug_data['bug_summary'],
+                    failure,
+                    test,
+                    failure is not None,
+                    test is not None,
+                    len(bug_data['bugzilla_suggestions']) > 0,
+                    bug_data['failure_count'],
+                ]
+
+                for (isection, section_name) in enumerate(SECTION_NAMES):
+                    summary_revision_job_type_section = summary_revision_job_type.sections[isection]
+
+                    run_time = summary_revision_job_type_section.run_time
+
+                    jobs_total = summary_revision_job_type_section.jobs_total
+                    jobs_testfailed = summary_revision_job_type_section.jobs_testfailed
                     jobs_testfailed_per_job = jobs_testfailed/jobs_total if jobs_total > 0 else 0
 
-                    failures_reproduced = bug_data['failure_reproduced'][section_name]
+                    failures_reproduced = summary_revision_job_type.failure_reproduced[ibug][isection]
                     failures_reproduced_per_job = failures_reproduced/jobs_total if jobs_total > 0 else 0
 
-                    tests_reproduced = bug_data['test_reproduced'][section_name]
+                    tests_reproduced = summary_revision_job_type.test_reproduced[ibug][isection]
                     tests_reproduced_per_job = tests_reproduced/jobs_total if jobs_total > 0 else 0
 
-                    line += '{};'.format(run_time)
-                    line += '{};'.format(jobs_total)
-                    line += '{};'.format(jobs_testfailed)
-                    line += '{:.2f};'.format(jobs_testfailed_per_job)
-                    line += '{};'.format(failures_reproduced)
-                    line += '{:.2f};'.format(failures_reproduced_per_job)
-                    line += '{};'.format(tests_reproduced)
-                    line += '{:.2f};'.format(tests_reproduced_per_job)
+                    row.extend([
+                        run_time,
+                        jobs_total,
+                        jobs_testfailed,
+                        '{:.2f}'.format(jobs_testfailed_per_job),
+                        failures_reproduced,
+                        '{:.2f}'.format(failures_reproduced_per_job),
+                        tests_reproduced,
+                        '{:.2f}'.format(tests_reproduced_per_job),
+                    ])
 
-                line = line[0:-1]
-                print(line)
+                yield row
 
 
-def output_csv_results(args, summary):
-    print('revision,job_type_name,section,result_type,result_name,count,reproduced')
+def generate_csv_results_rows(args, summary):
+    """Generate the header and the rows of the csv failure and test
+    results one at a time."""
+    yield ['revision', 'job_type_name', 'section', 'result_type', 'result_name',
+           'count', 'reproduced']
 
     for revision_url in summary:
         summary_revision = summary[revision_url]
@@ -780,29 +1151,57 @@ def output_csv_results(args, summary):
             summary_revision_job_type = summary_revision[job_type_name]
 
             for section_name in ISOLATION_SECTIONS:
-                summary_revision_job_type_section = summary_revision_job_type[section_name]
+                summary_revision_job_type_section = summary_revision_job_type.sections[
+                    SECTION_INDEXES[section_name]]
                 if args.include_failures:
-                    for failure_message in summary_revision_job_type_section['failures']:
-                        failure = summary_revision_job_type_section['failures'][failure_message]
-                        print('{};{};{};{};{};{};{}'.format(
+                    failures_reproduced = summary_revision_job_type_section.failures_reproduced
+                    for (failure_message, count) in summary_revision_job_type_section.failures.items():
+                        yield [
                             revision_url,
                             job_type_name,
                             section_name,
                             'failure',
                             failure_message,
-                            failure['count'],
-                            failure['failure_reproduced']))
+                            count,
+                            failures_reproduced[failure_message]]
                 if args.include_tests:
-                    for test_name in summary_revision_job_type_section['tests']:
-                        test = summary_revision_job_type_section['tests'][test_name]
-                        print('{};{};{};{};{};{};{}'.format(
+                    tests_reproduced = summary_revision_job_type_section.tests_reproduced
+                    for (test_name, count) in summary_revision_job_type_section.tests.items():
+                        yield [
                             revision_url,
                             job_type_name,
                             section_name,
                             'test',
                             test_name,
-                            test['count'],
-                            test['test_reproduced']))
+                            count,
+                            tests_reproduced[test_name]]
+
+
+def write_csv_rows(args, rows):
+    """Write rows to stdout in csv format using args.csv_delimiter as
+    the field delimiter. Fields containing the delimiter, quotes or
+    newlines are quoted. None is written as None rather than as an
+    empty field as csv.writer would."""
+    csv_writer = csv.writer(sys.stdout, delimiter=args.csv_delimiter, lineterminator='\n')
+    csv_writer.writerows(
+        ['None' if field is None else field for field in row] for row in rows)
+
+
+def output_csv_summary(args, summary):
+    """Output a csv file summarizing the test isolation results.
+
+    Note that a semi-colon (;) is used to delimit fields by default
+    instead of a comma (,) due to the embedded commas in the bug
+    summaries.
+
+    """
+    write_csv_rows(args, generate_csv_summary_rows(summary))
+
+
+def output_csv_results(args, summary):
+    """Output a csv file containing the counts of the individual
+    failures and tests for the isolation sections."""
+    write_csv_rows(args, generate_csv_results_rows(args, summary))
 
 
 def main():
@@ -888,6 +1287,14 @@ Each argument and its value must be on separate lines in the file.
         default=False,
         help='Dump cache statistics to stderr.')
 
+    parser.add_argument(
+        '--refresh-bugs',
+        default=False,
+        action='store_true',
+        help='Update the cached Bugzilla data with bugs created since the '
+        'last run and the failure counts of cached bugs which have '
+        'become available.')
+
     parser.add_argument(
         '--bug-creation-time',
         help='Starting creation time in YYYY-MM-DD or '
@@ -909,6 +1316,20 @@ Each argument and its value must be on separate lines in the file.
         default=[],
         help='Only returns results for bug the specified bug.')
 
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=8,
+        help='Maximum number of bugs to process concurrently.')
+
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=1,
+        help='Number of worker processes used to fetch and summarize the '
+        'revisions in parallel. The request rate to each host is divided '
+        'between the processes.')
+
     parser.add_argument(
         '--raw',
         action='store_true',
@@ -927,6 +1348,12 @@ Each argument and its value must be on separate lines in the file.
         default=False,
         help='Output test data in csv format. Does not include individual failures.')
 
+    parser.add_argument(
+        '--csv-delimiter',
+        default=';',
+        help='Field delimiter used in csv output. Defaults to a semi-colon (;) '
+        'due to the embedded commas in the bug summaries.')
+
     parser.add_argument(
         '--include-failures',
         action='store_true',
@@ -963,18 +1390,19 @@ Each argument and its value must be on separate lines in the file.
         os.makedirs(args.cache)
     cache.CACHE_HOME = args.cache
 
-    init_treeherder(args.treeherder_url)
+    init_treeherder(args.treeherder_url, offline=args.offline,
+                    repositories_ttl=args.repositories_ttl)
 
     summary = args.func(args)
 
     if args.raw:
-        json.dump(summary, sys.stdout)
+        json.dump(summary_to_json(summary), sys.stdout)
     elif args.csv_summary:
         output_csv_summary(args, summary)
     elif args.csv_results:
         output_csv_results(args, summary)
     else:
-        json.dump(summary, sys.stdout, indent=2)
+        json.dump(summary_to_json(summary), sys.stdout, indent=2)
 
     if args.dump_cache_stats:
         cache.stats()
@@ -4,21 +4,234 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import argparse
+import concurrent.futures
 import csv
+import functools
 import json
-import re
 import sys
 
+import json_stream
+
 
 RELEASES = set(["mozilla-beta", "mozilla-central", "mozilla-release"])
 INTEGRATION = set(["autoland", "fx-team"])
 TRUNK = set(["autoland", "mozilla-central", "comm-central"])
 ALL = set(["try"]) | TRUNK | INTEGRATION | RELEASES
 
+WILDCARD = ".*"
+
+COST_INDEX = None
+
+
 def args_key(*args):
     return ",".join(str(arg) for arg in args)
 
 
+def prune_task(task):
+    """Return a copy of the task definition from a taskgraph containing
+    only the fields used to find its costs."""
+    extra = task["task"]["extra"]
+    pruned_extra = {}
+    if "treeherder" in extra:
+        pruned_extra["treeherder"] = extra["treeherder"]
+    if "suite" in extra:
+        pruned_extra["suite"] = extra["suite"]
+    attributes = task.get("attributes", {})
+    pruned_attributes = {}
+    if "run_on_projects" in attributes:
+        pruned_attributes["run_on_projects"] = attributes["run_on_projects"]
+    return {
+        "task": {
+            "provisionerId": task["task"].get("provisionerId"),
+            "workerType": task["task"].get("workerType"),
+            "extra": pruned_extra,
+        },
+        "attributes": pruned_attributes,
+    }
+
+
+def load_costs(costs_paths):
+    """Yield the costs from each of the json files in costs_paths
+    without loading the whole files."""
+    for costs_path in costs_paths:
+        with open(costs_path) as costs_file:
+            for cost in json_stream.iter_array_items(costs_file):
+                yield cost
+
+
+def load_tasks(tasks_path):
+    """Yield the (task_label, task) pairs from the taskgraph json file
+    tasks_path without loading the whole file. Each task is pruned to
+    the fields used to find its costs."""
+    with open(tasks_path) as tasks_file:
+        for task_label, task in json_stream.iter_object_items(tasks_file):
+            yield (task_label, prune_task(task))
+
+
+class CostIndex(object):
+    """Index of costs keyed by provisionerId, workerType, project, tier,
+    symbol and collection.
+
+    Each entry maps (suite, groupSymbol) to the cost key so that tasks
+    which do not specify a suite or groupSymbol can be resolved with a
+    dict probe instead of matching every cost key.
+    """
+    def __init__(self, cost_dict):
+        self.cost_dict = cost_dict
+        self.index = {}
+        for cost_key, cost in cost_dict.items():
+            index_key = args_key(
+                cost["provisionerId"],
+                cost["workerType"],
+                cost["project"],
+                cost["tier"],
+                cost["symbol"],
+                cost["collection"],
+            )
+            self.index.setdefault(index_key, {})[
+                (str(cost["suite"]), str(cost["groupSymbol"]))] = cost_key
+
+    def find(self, provisionerId, workerType, project, tier, suite, groupSymbol,
+             symbol, collection):
+        """Return the list of cost keys matching the task. A suite or
+        groupSymbol of WILDCARD matches any value."""
+        task_key = args_key(
+            provisionerId,
+            workerType,
+            project,
+            tier,
+            suite,
+            groupSymbol,
+            symbol,
+            collection,
+        )
+        if task_key in self.cost_dict:
+            return [task_key]
+
+        suite_group_costs = self.index.get(
+            args_key(provisionerId, workerType, project, tier, symbol, collection))
+        if not suite_group_costs:
+            return []
+
+        suite = str(suite)
+        groupSymbol = str(groupSymbol)
+        return [
+            cost_key for (cost_suite, cost_groupSymbol), cost_key in suite_group_costs.items()
+            if (suite == WILDCARD or suite == cost_suite) and
+            (groupSymbol == WILDCARD or groupSymbol == cost_groupSymbol)
+        ]
+
+
+def attribute_costs(args, cost_index, tasks_path):
+    """Return a dict keyed by cost key of the costs, with the attached
+    task labels, for the tasks in the taskgraph json file tasks_path."""
+    data = {}
+
+    for task_label, task in load_tasks(tasks_path):
+        extra = task["task"]["extra"]
+        if "treeherder" not in extra:
+            continue
+        treeherder = extra["treeherder"]
+
+        tier = treeherder["tier"]
+        if args.tiers and tier not in args.tiers:
+            continue
+
+        provisionerId = task["task"]["provisionerId"]
+        workerType = task["task"]["workerType"]
+        run_on_projects = task["attributes"]["run_on_projects"]
+        # If the suite or groupSymbol are not specified, treat
+        # them as wild-cards when finding the matching cost.
+        suite = extra.get("suite", WILDCARD)
+        groupSymbol = treeherder.get("groupSymbol", WILDCARD)
+        symbol = treeherder["symbol"]
+        collection = list(treeherder["collection"].keys())[0]
+
+        projects = set()
+        for project in run_on_projects:
+            if project == "trunk":
+                projects |= TRUNK
+            elif project == "all":
+                projects |= ALL
+            elif project == "integration":
+                projects |= INTEGRATION
+            elif project == "releases":
+                projects |= RELEASES
+            elif project == "release":
+                projects |= set(["mozilla-release"])
+            elif project == "central":
+                projects |= set(["mozilla-central"])
+            elif project == "beta":
+                projects |= set(["mozilla-beta"])
+            else:
+                assert project in ALL, "unknown project %s" % project
+                projects.add(project)
+
+        if args.projects:
+            projects = projects & set(args.projects)
+
+        for project in projects:
+            task_key = args_key(
+                provisionerId,
+                workerType,
+                project,
+                tier,
+                suite,
+                groupSymbol,
+                symbol,
+                collection,
+            )
+            candidate_cost_keys = cost_index.find(
+                provisionerId,
+                workerType,
+                project,
+                tier,
+                suite,
+                groupSymbol,
+                symbol,
+                collection,
+            )
+            if len(candidate_cost_keys) == 0:
+                if args.verbose:
+                    print(
+                        "task_key {} has no cost".format(task_key), file=sys.stderr
+                    )
+                task_key = None
+            elif len(candidate_cost_keys) > 1:
+                if args.verbose:
+                    print(
+                        "task_key {} has too many cost candidates {}".format(
+                            task_key, set(candidate_cost_keys)
+                        ),
+                        file=sys.stderr,
+                    )
+                task_key = None
+            else:
+                task_key = candidate_cost_keys[0]
+
+            if task_key is not None:
+                if task_key not in data:
+                    task_cost = dict(cost_index.cost_dict[task_key])
+                    task_cost["label"] = task_label
+                    data[task_key] = task_cost
+                else:
+                    task_cost = data[task_key]
+                    task_cost["label"] += ", " + task_label
+
+    return data
+
+
+def init_attribute_costs_worker(cost_index):
+    """Initialize a worker process with the cost index shared by all
+    of the taskgraphs."""
+    global COST_INDEX
+    COST_INDEX = cost_index
+
+
+def attribute_worker_costs(args, tasks_path):
+    return attribute_costs(args, COST_INDEX, tasks_path)
+
+
 def main():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -60,13 +273,32 @@ or
 
 python %(prog)s --costs=costs.json --tasks=tasks.json --json 2> costs.err > costs-annotated.json
 
+If multiple --tasks files are specified, the costs are attributed for
+each of them and the csv output contains an additional snapshot column
+with the path of the tasks file while the json output is keyed by the
+path of the tasks file.
+
+python %(prog)s --costs=costs.json --tasks=tasks-2020-01-06.json --tasks=tasks-2020-01-07.json --processes=2 > costs-annotated.csv
+
 """,
     )
     parser.add_argument(
         "--costs", action='append', default=[], help="Path to json file containing costs.", required=True
     )
     parser.add_argument(
-        "--tasks", help="Path to json file containing tasks.", required=True
+        "--tasks",
+        action="append",
+        default=[],
+        help="Path to json file containing tasks. May be specified multiple "
+        "times to attribute costs for several taskgraph snapshots.",
+        required=True,
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of worker processes used to attribute costs when "
+        "multiple --tasks files are specified.",
     )
     parser.add_argument(
         "--project",
@@ -100,16 +332,8 @@ python %(prog)s --costs=costs.json --tasks=tasks.json --json 2> costs.err > cost
 
     projects = set(args.projects)
 
-    costs = []
-    for costs_path in args.costs:
-        with open(costs_path) as costs_file:
-            costs.extend(json.load(costs_file))
-
-    with open(args.tasks) as tasks_file:
-        tasks = json.load(tasks_file)
-
     cost_dict = {}
-    for cost in costs:
+    for cost in load_costs(args.costs):
         cost_key = args_key(
             cost["provisionerId"],
             cost["workerType"],
@@ -123,109 +347,42 @@ python %(prog)s --costs=costs.json --tasks=tasks.json --json 2> costs.err > cost
         assert cost_key not in cost_dict
         cost_dict[cost_key] = cost
 
-    data = {}
-
-    for task_label in tasks:
-        task = tasks[task_label]
-        extra = task["task"]["extra"]
-        if "treeherder" not in extra:
-            continue
-        treeherder = extra["treeherder"]
-
-        tier = treeherder["tier"]
-        if args.tiers and tier not in args.tiers:
-            continue
-
-        provisionerId = task["task"]["provisionerId"]
-        workerType = task["task"]["workerType"]
-        run_on_projects = task["attributes"]["run_on_projects"]
-        # If the suite or groupSymbol are not specified, treat
-        # them as wild-cards and use regular expressions to
-        # find the matching cost.
-        suite = extra.get("suite", ".*")
-        groupSymbol = treeherder.get("groupSymbol", ".*")
-        symbol = treeherder["symbol"]
-        collection = list(treeherder["collection"].keys())[0]
-
-        projects = set()
-        for project in run_on_projects:
-            if project == "trunk":
-                projects |= TRUNK
-            elif project == "all":
-                projects |= ALL
-            elif project == "integration":
-                projects |= INTEGRATION
-            elif project == "releases":
-                projects |= RELEASES
-            elif project == "release":
-                projects |= set(["mozilla-release"])
-            elif project == "central":
-                projects |= set(["mozilla-central"])
-            elif project == "beta":
-                projects |= set(["mozilla-beta"])
-            else:
-                assert project in ALL, "unknown project %s" % project
-                projects.add(project)
-
-        if args.projects:
-            projects = projects & set(args.projects)
+    cost_index = CostIndex(cost_dict)
 
-        for project in projects:
-            task_key = args_key(
-                provisionerId,
-                workerType,
-                project,
-                tier,
-                suite,
-                groupSymbol,
-                symbol,
-                collection,
-            )
-            if task_key not in cost_dict:
-                # We do not have an exact match, so treat
-                # the task_key as a pattern and search the costs
-                # for matches.
-                re_key = re.compile(task_key)
-                candidate_cost_keys = set(
-                    [key for key in cost_dict.keys() if re_key.match(key)]
-                )
-                if len(candidate_cost_keys) == 0:
-                    if args.verbose:
-                        print(
-                            "task_key {} has no cost".format(task_key), file=sys.stderr
-                        )
-                    task_key = None
-                elif len(candidate_cost_keys) > 1:
-                    if args.verbose:
-                        print(
-                            "task_key {} has too many cost candidates {}".format(
-                                task_key, candidate_cost_keys
-                            ),
-                            file=sys.stderr,
-                        )
-                    task_key = None
-                else:
-                    task_key = candidate_cost_keys.pop()
-
-            if task_key is not None:
-                if task_key not in data:
-                    task_cost = cost_dict[task_key]
-                    task_cost["label"] = task_label
-                    data[task_key] = task_cost
-                else:
-                    task_cost = data[task_key]
-                    task_cost["label"] += ", " + task_label
-
-    if args.json:
-        print(json.dumps(data, indent=2))
-    elif not data:
-        pass
+    if len(args.tasks) > 1 and args.processes > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.processes,
+                initializer=init_attribute_costs_worker,
+                initargs=(cost_index,)) as executor:
+            snapshots_data = list(executor.map(
+                functools.partial(attribute_worker_costs, args), args.tasks))
+    else:
+        snapshots_data = [attribute_costs(args, cost_index, tasks_path)
+                          for tasks_path in args.tasks]
+
+    if len(args.tasks) == 1:
+        data = snapshots_data[0]
+        if args.json:
+            print(json.dumps(data, indent=2))
+        elif not data:
+            pass
+        else:
+            fieldnames = list(data.values())[0].keys()
+            csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+            csv_writer.writeheader()
+            for task_key, task_cost in data.items():
+                csv_writer.writerow(task_cost)
+    elif args.json:
+        print(json.dumps(dict(zip(args.tasks, snapshots_data)), indent=2))
     else:
-        fieldnames = task_cost.keys()
-        csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-        csv_writer.writeheader()
-        for task_key, task_cost in data.items():
-            csv_writer.writerow(task_cost)
+        csv_writer = None
+        for tasks_path, data in zip(args.tasks, snapshots_data):
+            for task_key, task_cost in data.items():
+                if csv_writer is None:
+                    fieldnames = ["snapshot"] + list(task_cost.keys())
+                    csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+                    csv_writer.writeheader()
+                csv_writer.writerow(dict(task_cost, snapshot=tasks_path))
 
 
 if __name__ == "__main__":
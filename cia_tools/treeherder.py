@@ -18,39 +18,56 @@ import utils
 CLIENT = None
 REPOSITORIES = None
 URL = None
+OFFLINE = False
+REPOSITORIES_TTL = 86400
 
 logger = logging.getLogger()
 
 
 def retry_client_request(func, max_attempts, *args, **kwargs):
     """Retry executing a function which calls Treeherder's client which
-    can raise request Exceptions."""
-    attempt = 0
-    result = None
-    while attempt < max_attempts:
-        attempt += 1
+    can raise request Exceptions.
+
+    Requests share the rate limiter, circuit breaker and retry policy
+    used by utils.retry_request for the Treeherder host. Concurrent
+    identical requests are coalesced into a single request. Return
+    None if the request failed or the Treeherder circuit is open.
+    """
+    key = ('retry_client_request', func.__name__, json.dumps(args),
+           json.dumps(kwargs, sort_keys=True))
+    return utils.SINGLE_FLIGHT.do(key, _retry_client_request, func, max_attempts,
+                                  *args, **kwargs)
+
+
+def _retry_client_request(func, max_attempts, *args, **kwargs):
+    def attempt(attempt_number):
         try:
-            result = func(*args, **kwargs)
-            break
+            return (utils.ATTEMPT_OK, func(*args, **kwargs), None)
         except requests.HTTPError as e:
-            if '503 Server Error' not in str(e):
-                raise
-            logger.error('{}: HTTP 503 Server too busy. Attempt {}/{}.'.format(
-                             func.__name__, attempt, max_attempts))
-        except (requests.ConnectionError, requests.ConnectTimeout) as e:
-            logger.error('{}: {}: Attempt {}/{}'.format(
-                func.__name__, e.__class__.__name__, attempt, max_attempts))
-        utils.wait()
+            if e.response is None or e.response.status_code not in utils.RETRY_STATUS_CODES:
+                return (utils.ATTEMPT_ERROR, e, None)
+            logger.error('{}: HTTP {} {}. Attempt {}/{}.'.format(
+                func.__name__, e.response.status_code, e.response.reason,
+                attempt_number, max_attempts))
+            return (utils.ATTEMPT_RETRY, None, utils.get_retry_after(e.response))
 
-    if attempt == max_attempts:
-        logger.error('Exceeded maximum attempts, aborting {}({}, {})'.format(
-            func.__name__, args, kwargs))
+    return utils.retry_attempts(func.__name__, max_attempts, URL, attempt,
+                                '{}, {}'.format(args, kwargs))
 
-    return result
 
+def init_treeherder(treeherder_url, offline=False, repositories_ttl=None):
+    """init_treeherder
 
-def init_treeherder(treeherder_url):
-    global CLIENT, URL, REPOSITORIES
+    Initialize the Treeherder client. The repositories are not
+    retrieved until they are first needed by get_repository_by_id.
+
+    :param: treeherder_url - url of the Treeherder server.
+    :param: offline - if True, only use the cached repositories and
+            never query Treeherder for them.
+    :param: repositories_ttl - number of seconds before the cached
+            repositories are considered stale.
+    """
+    global CLIENT, URL, OFFLINE, REPOSITORIES_TTL
 
     if URL is None:
         URL = treeherder_url
@@ -58,14 +75,43 @@ def init_treeherder(treeherder_url):
     if CLIENT is None:
         CLIENT = thclient.client.TreeherderClient(server_url=URL)
 
-    if REPOSITORIES is None:
-        REPOSITORIES = {}
-        repositories = CLIENT.get_repositories()
-        for repository in repositories:
-            REPOSITORIES[repository['id']] = repository
+    OFFLINE = offline
+    if repositories_ttl is not None:
+        REPOSITORIES_TTL = repositories_ttl
+
+
+def load_repositories():
+    """load_repositories
+
+    Load the Treeherder repositories into REPOSITORIES keyed by id,
+    using the cached copy if it is younger than REPOSITORIES_TTL or
+    if running offline.
+    """
+    global REPOSITORIES
+
+    cache_attributes = ['treeherder']
+
+    max_age = None if OFFLINE else REPOSITORIES_TTL
+    repositories_data = cache.load(cache_attributes, 'repositories.json', max_age=max_age)
+    if repositories_data:
+        repositories = json.loads(repositories_data)
+    elif OFFLINE:
+        raise ValueError('Treeherder repositories are not cached. '
+                         'Rerun without --offline to populate the cache.')
+    else:
+        repositories = retry_client_request(CLIENT.get_repositories, 3)
+        if repositories is None:
+            raise ValueError('Unable to retrieve Treeherder repositories.')
+        cache.save(cache_attributes, 'repositories.json', json.dumps(repositories, indent=2))
+
+    REPOSITORIES = {}
+    for repository in repositories:
+        REPOSITORIES[repository['id']] = repository
 
 
 def get_repository_by_id(id):
+    if REPOSITORIES is None:
+        load_repositories()
     return REPOSITORIES[id]
 
 
@@ -176,7 +222,11 @@ def get_pushes_jobs_json(args, repo, update_cache=False):
             jobs = json.loads(push_jobs_data)
         else:
             jobs = retry_client_request(CLIENT.get_jobs, 3, repo, push_id=push['id'], count=None)
-            cache.save(cache_attributes_push_jobs, push['id'], json.dumps(jobs, indent=2))
+            if jobs is None:
+                logger.warning("Unable to get jobs for push %s", push['id'])
+                jobs = []
+            else:
+                cache.save(cache_attributes_push_jobs, push['id'], json.dumps(jobs, indent=2))
 
         if not args.job_filters:
             push['jobs'] = jobs
@@ -264,7 +314,8 @@ def get_pushes_jobs_job_details_json(args, repo, update_cache=False):
 def get_job_by_repo_job_id_json(args, repo, job_id, update_cache=False):
     """get_job_by_repo_job_id_json
 
-    Retrieve job given args, repo and job_id
+    Retrieve job given args, repo and job_id or None if the job could
+    not be retrieved.
 
     """
     cache_attributes = ['treeherder', repo, 'jobs']
@@ -274,33 +325,74 @@ def get_job_by_repo_job_id_json(args, repo, job_id, update_cache=False):
         jobs = [json.loads(job_data)]
     else:
         jobs = retry_client_request(CLIENT.get_jobs, 3, repo, id=job_id)
-        if jobs:
-            for job in jobs:
-                cache.save(cache_attributes, job['id'], json.dumps(job, indent=2))
+        if not jobs:
+            logger.warning("Unable to get job %s for %s", job_id, repo)
+            return None
+        for job in jobs:
+            cache.save(cache_attributes, job['id'], json.dumps(job, indent=2))
 
     return jobs[0]
 
 
+BUG_JOB_MAP_BATCH_SIZE = 100
+
+
 def get_bug_job_map_json(args, repo, job_id, update_cache=False):
     """get_bug_job_map_json
 
     Retrieve bug_job_map given args, repo and job_id
 
     """
-    cache_attributes = ['treeherder', repo, 'bug-job-map']
+    return get_bug_job_maps_json(args, repo, [job_id], update_cache=update_cache)[job_id]
 
-    bug_job_map_url = '%s/api/project/%s/bug-job-map/?job_id=%s' % (
-        (URL, repo, job_id))
 
-    bug_job_map_data = cache.load(cache_attributes, job_id)
-    if bug_job_map_data and not update_cache:
-        bug_job_map = json.loads(bug_job_map_data)
-        bug_job_map_data = None
-    else:
-        bug_job_map = utils.get_remote_json(bug_job_map_url)
-        cache.save(cache_attributes, job_id, json.dumps(bug_job_map, indent=2))
+def get_bug_job_maps_json(args, repo, job_ids, update_cache=False):
+    """get_bug_job_maps_json
 
-    return bug_job_map
+    Retrieve the bug_job_map for each of the job_ids given args and
+    repo, returning a dict keyed by job_id.
+
+    Jobs which are not cached are requested from Treeherder in batches
+    of BUG_JOB_MAP_BATCH_SIZE job ids. Each job is cached in its own
+    entry, including the jobs without bug associations whose empty
+    entries prevent them from being requested again unless
+    update_cache is set.
+
+    """
+    cache_attributes = ['treeherder', repo, 'bug-job-map']
+
+    bug_job_maps = {}
+
+    missing_job_ids = []
+    for job_id in job_ids:
+        if job_id in bug_job_maps:
+            continue
+        bug_job_map_data = None if update_cache else cache.load(cache_attributes, job_id)
+        if bug_job_map_data:
+            bug_job_maps[job_id] = json.loads(bug_job_map_data)
+        else:
+            bug_job_maps[job_id] = []
+            missing_job_ids.append(job_id)
+
+    if not missing_job_ids:
+        return bug_job_maps
+
+    bug_job_map_url = '%s/api/project/%s/bug-job-map/' % (URL, repo)
+    for start in range(0, len(missing_job_ids), BUG_JOB_MAP_BATCH_SIZE):
+        batch_job_ids = missing_job_ids[start:start + BUG_JOB_MAP_BATCH_SIZE]
+        batch_bug_job_map = utils.get_remote_json(bug_job_map_url,
+                                                  params={'job_id': batch_job_ids})
+        if batch_bug_job_map is None:
+            logger.warning('get_bug_job_maps_json: failed to retrieve '
+                           'bug_job_map for jobs %s', batch_job_ids)
+            continue
+        for job_bug in batch_bug_job_map:
+            bug_job_maps[job_bug['job_id']].append(job_bug)
+        for job_id in batch_job_ids:
+            cache.save(cache_attributes, job_id,
+                       json.dumps(bug_job_maps[job_id], indent=2))
+
+    return bug_job_maps
 
 
 def get_job_bugzilla_suggestions_json(args, repo, job_id, include_related_bugs=False, update_cache=False):
@@ -319,7 +411,11 @@ def get_job_bugzilla_suggestions_json(args, repo, job_id, include_related_bugs=F
             (URL, repo, job_id))
 
         suggestions = utils.get_remote_json(bugzilla_suggestions_url)
-        cache.save(cache_attributes, job_id, json.dumps(suggestions, indent=2))
+        if suggestions is None:
+            logger.warning("Unable to get bug suggestions for job %s", job_id)
+            suggestions = []
+        else:
+            cache.save(cache_attributes, job_id, json.dumps(suggestions, indent=2))
 
     if args.test_failure_pattern:
         bugzilla_suggestions = [
@@ -8,10 +8,12 @@
 
 import copy
 import datetime
+import email.utils
 import json
 import logging
 import os
 import random
+import threading
 import time
 
 from urllib.parse import urlparse
@@ -25,43 +27,333 @@ JSON = 'application/json'
 BINARY = 'application/octet-stream'
 
 
-def wait():
-    time.sleep(random.randrange(0, 30, 1))
+# Status codes which indicate the server is overloaded or temporarily
+# unavailable and that the request may succeed if retried later.
+RETRY_STATUS_CODES = (429, 502, 503, 504)
 
 
-def retry_request(func, max_attempts, *args, **kwargs):
+class TokenBucket(object):
+    """Thread safe token bucket used to limit the rate of requests made
+    to a host.
+
+    The rate is adaptive: it is halved each time the host reports it is
+    overloaded and slowly recovers towards max_rate as requests succeed.
+    """
+
+    def __init__(self, max_rate=10.0, capacity=10.0, min_rate=0.1):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = time.monotonic()
+        self.not_before = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if now >= self.not_before and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = max(self.not_before - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+
+    def pause(self, delay):
+        """Prevent any thread from acquiring a token for delay seconds."""
+        with self.lock:
+            self.not_before = max(self.not_before, time.monotonic() + delay)
+
+    def decrease(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 1)
+
+    def increase(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+class CircuitBreaker(object):
+    """Thread safe circuit breaker which stops requests to a host after
+    failure_threshold consecutive failures. After reset_timeout seconds
+    a single trial request is allowed. If it succeeds the circuit is
+    closed, otherwise it is opened again. Requests made while the trial
+    is in progress wait for its outcome.
+    """
+
+    def __init__(self, failure_threshold=10, reset_timeout=300):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a request may be made or False if the circuit
+        is open, waiting while a trial request is in progress."""
+        while True:
+            with self.lock:
+                if self.opened_at is None:
+                    return True
+                if not self.trial:
+                    if time.monotonic() - self.opened_at < self.reset_timeout:
+                        return False
+                    self.trial = True
+                    return True
+            time.sleep(0.1)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+    def release_trial(self):
+        """End a trial request which ended without a success or failure
+        being recorded so that another trial request can be made."""
+        with self.lock:
+            self.trial = False
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter which honors the server's
+    Retry-After header.
+    """
+
+    def __init__(self, backoff_base=1.0, backoff_max=60.0):
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.backoff_max,
+                                      self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+
+RETRY_POLICY = RetryPolicy()
+
+HOST_CONTROLS = {}
+HOST_CONTROLS_LOCK = threading.Lock()
+# Fraction of each host's request rate available to this process.
+HOST_RATE_SHARE = 1.0
+
+
+def get_host_controls(url):
+    """Return the (TokenBucket, CircuitBreaker) pair shared by all
+    threads making requests to the host of url."""
+    host = urlparse(url).netloc
+    with HOST_CONTROLS_LOCK:
+        if host not in HOST_CONTROLS:
+            bucket = TokenBucket(max_rate=10.0 * HOST_RATE_SHARE,
+                                 capacity=max(1.0, 10.0 * HOST_RATE_SHARE),
+                                 min_rate=0.1 * HOST_RATE_SHARE)
+            HOST_CONTROLS[host] = (bucket, CircuitBreaker())
+        return HOST_CONTROLS[host]
+
+
+def share_host_rate(processes):
+    """Limit this process to its share of each host's request rate when
+    the requests are made by processes worker processes, each with its
+    own HOST_CONTROLS. Controls inherited from the parent process are
+    discarded."""
+    global HOST_RATE_SHARE
+
+    with HOST_CONTROLS_LOCK:
+        HOST_RATE_SHARE = 1.0 / processes
+        HOST_CONTROLS.clear()
+
+
+def get_retry_after(response):
+    """Return the number of seconds requested by the Retry-After header
+    of response or None if it was not specified."""
+    if response is None:
+        return None
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (retry_date - datetime.datetime.now(retry_date.tzinfo)).total_seconds())
+
+
+# The outcomes of a request attempt made by retry_attempts.
+# The request succeeded.
+ATTEMPT_OK = 'ok'
+# The host responded with an error which is not retried.
+ATTEMPT_ERROR = 'error'
+# The host is overloaded or unavailable and the request is retried.
+ATTEMPT_RETRY = 'retry'
+# There was no response and the request is not retried.
+ATTEMPT_ABORT = 'abort'
+
+
+def retry_attempts(name, max_attempts, url, attempt, description):
+    """Call attempt up to max_attempts times to make a request to the
+    host of url and return the result.
+
+    attempt is called with the attempt number and returns a tuple
+    (outcome, value, retry_after) where outcome is one of the ATTEMPT_
+    constants, value is the result for ATTEMPT_OK, ATTEMPT_ABORT and
+    ATTEMPT_RETRY or the exception to raise for ATTEMPT_ERROR, and
+    retry_after is the delay requested by the host or None.
+
+    Requests are rate limited per host. Retryable failures,
+    ConnectionError and Timeout are retried using RETRY_POLICY and are
+    counted against the host's circuit breaker. If the circuit is open
+    None is returned. Any other exception raised by attempt ends a
+    trial request without changing the state of the circuit.
+    """
+    bucket, breaker = get_host_controls(url)
+    result = None
+    for attempt_number in range(1, max_attempts + 1):
+        if not breaker.allow():
+            logger.error('{}: Circuit open for {}, Aborting {}.'.format(
+                name, urlparse(url).netloc, description))
+            return None
+        bucket.acquire()
+        try:
+            (outcome, value, retry_after) = attempt(attempt_number)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            logger.error('{}: {}: Attempt {}/{}, {}'.format(
+                name, e.__class__.__name__, attempt_number, max_attempts, description))
+            (outcome, value, retry_after) = (None, None, None)
+        except BaseException:
+            breaker.release_trial()
+            raise
+
+        if outcome == ATTEMPT_OK:
+            breaker.record_success()
+            bucket.increase()
+            return value
+        if outcome == ATTEMPT_ERROR:
+            # The host is responding even though the request failed.
+            breaker.record_success()
+            raise value
+        if outcome == ATTEMPT_ABORT:
+            breaker.release_trial()
+            return value
+
+        breaker.record_failure()
+        if outcome == ATTEMPT_RETRY:
+            result = value
+            bucket.decrease()
+        if attempt_number < max_attempts:
+            delay = RETRY_POLICY.delay(attempt_number, retry_after)
+            if retry_after is not None:
+                bucket.pause(delay)
+            time.sleep(delay)
+
+    logger.error('Exceeded maximum attempts, aborting {}({})'.format(name, description))
+    return result
+
+
+def retry_request(func, max_attempts, url, *args, **kwargs):
     """Retry executing a function which returns request Response object
-    and which can raise request Exceptions."""
-    attempt = 0
-    response = None
-    while attempt < max_attempts:
-        attempt += 1
+    and which can raise request Exceptions using retry_attempts.
+    Return the last Response or None if there was no response or the
+    host's circuit breaker is open.
+    """
+    description = '{}, {}, {}'.format(url, args, kwargs)
+
+    def attempt(attempt_number):
+        response = func(url, *args, **kwargs)
+        if response is None:
+            logger.error('{}: No response: Attempt {}/{}, Aborting {}.'.format(
+                func.__name__, attempt_number, max_attempts, description))
+            return (ATTEMPT_ABORT, None, None)
+        if response.ok:
+            return (ATTEMPT_OK, response, None)
+        if response.status_code in RETRY_STATUS_CODES:
+            logger.error('{}: HTTP {} {}. Attempt {}/{}, {}.'.format(
+                func.__name__, response.status_code, response.reason,
+                attempt_number, max_attempts, description))
+            return (ATTEMPT_RETRY, response, get_retry_after(response))
         try:
-            response = func(*args, **kwargs)
-            if not response:
-                logger.error('{}: No response: Attempt {}/{}, Aborting {}, {}.'.format(
-                    func.__name__, attempt, max_attempts, args, kwargs))
-                break
-            elif response.ok:
-                break
-            elif response.status_code == 503:
-                logger.error('{}: HTTP 503 Server too busy. Attempt {}/{}, {}, {}.'.format(
-                    func.__name__, attempt, max_attempts, args, kwargs))
-            elif response.status_code == 504:
-                logger.error('{}: HTTP 504 Server Gateway Timeout. Attempt {}/{}, Aborting {}, {}.'.format(
-                    func.__name__, attempt, max_attempts, args, kwargs))
-                break
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            return (ATTEMPT_ERROR, e, None)
+        return (ATTEMPT_OK, response, None)
+
+    return retry_attempts(func.__name__, max_attempts, url, attempt, description)
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key onto a single in-flight
+    call.
+
+    The first caller for a key executes the function. Callers which
+    arrive while it is in flight wait for it to complete and receive
+    their own deep copy of its result, or have its exception re-raised,
+    so that callers which modify the result do not interfere with each
+    other.
+    """
+
+    class _Call(object):
+        def __init__(self):
+            self.event = threading.Event()
+            self.waiters = 0
+            self.results = []
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = SingleFlight._Call()
+                leader = True
             else:
-                response.raise_for_status()
-        except (requests.ConnectionError, requests.ConnectTimeout) as e:
-            logger.error('{}: {}: Attempt {}/{}, {}, {}'.format(
-                func.__name__, e.__class__.__name__, attempt, max_attempts, args, kwargs))
-        wait()
+                call.waiters += 1
+                leader = False
 
-    if attempt == max_attempts - 1:
-        print('Exceeded maximum attempts, aborting {}({}, {})'.format(func.__name__, args, kwargs))
+        if not leader:
+            call.event.wait()
+            with self.lock:
+                if call.error is not None:
+                    raise call.error
+                return call.results.pop()
 
-    return response
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            with self.lock:
+                del self.calls[key]
+                call.error = e
+            call.event.set()
+            raise
+        with self.lock:
+            del self.calls[key]
+            call.results = [copy.deepcopy(result) for i in range(call.waiters)]
+        call.event.set()
+        return result
+
+
+SINGLE_FLIGHT = SingleFlight()
 
 
 class RequestsWrapper(object):
@@ -136,6 +428,11 @@ def get_remote_json(url, stream=False, params=None):
         with local_file:
             return json.load(local_file)
 
+    key = ('get_remote_json', url, json.dumps(params, sort_keys=True))
+    return SINGLE_FLIGHT.do(key, _get_remote_json, url, stream=stream, params=params)
+
+
+def _get_remote_json(url, stream=False, params=None):
     response = requestswrapper._get(url, mimetype=JSON, stream=stream, params=params)
     if response and response.ok:
         return response.json()